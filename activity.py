@@ -0,0 +1,203 @@
+import asyncio
+import glob
+import json
+import os
+import time
+from collections import deque
+
+ACTIVITY = "activity.json"
+
+HOUR = 3600
+DAY = 86400
+
+# time windows of the leaderboard, as (resolution, number of buckets)
+WINDOWS = {"day": (HOUR, 24), "week": (HOUR, 168), "month": (DAY, 30)}
+
+
+class Rolling:
+    # message counts of a guild in time buckets of `span` seconds. the totals
+    # of every window are kept up to date, a bucket leaving a window is
+    # subtracted from its totals once, and buckets older than the longest
+    # window are dropped, so a user never takes more than one entry per bucket
+
+    def __init__(self, span, windows):
+        self.span = span
+        self.windows = dict(sorted(windows.items(), key=lambda item: item[1]))
+        self.buckets = {}  # number -> {id: messages}
+        self.queues = {name: deque() for name in windows}  # numbers, oldest first
+        self.totals = {name: {} for name in windows}
+        self.current = None
+        self.version = 0  # changes whenever a total does
+
+    def advance(self, now=None):
+        # starts the bucket `now` falls in, expiring the ones that got too old
+        number = int((time.time() if now is None else now) // self.span)
+        if self.current is not None and number <= self.current:
+            return
+
+        self.current = number
+        self.buckets[number] = {}
+        self.version += 1
+        longest = next(reversed(self.windows))
+
+        for name, length in self.windows.items():
+            queue = self.queues[name]
+            totals = self.totals[name]
+            queue.append(number)
+
+            while queue[0] <= number - length:
+                expired = queue.popleft()
+                for id, messages in self.buckets[expired].items():
+                    _add(totals, id, -messages)
+
+                if name == longest:
+                    del self.buckets[expired]
+
+    def count(self, id, amount=1, when=None):
+        # adds messages sent at `when` (now by default), messages older than
+        # every window are ignored
+        self.advance()
+        self._count(
+            id, amount, self.current if when is None else int(when // self.span)
+        )
+
+    def _count(self, id, amount, number):
+        bucket = self.buckets.get(number)
+        if bucket is None:
+            return
+
+        # a bucket never goes below zero, even if its messages were counted
+        # before the bot started
+        amount = max(amount, -bucket.get(id, 0))
+        if not amount:
+            return
+
+        _add(bucket, id, amount)
+        for name, length in self.windows.items():
+            if number > self.current - length:
+                _add(self.totals[name], id, amount)
+        self.version += 1
+
+    def get(self, name):
+        self.advance()
+        return self.totals[name]
+
+    def dump(self):
+        return self.buckets
+
+    @classmethod
+    def load(cls, span, windows, buckets):
+        rolling = cls(span, windows)
+        for number in sorted(buckets, key=int):
+            rolling.advance(int(number) * span)
+            for id, messages in buckets[number].items():
+                rolling._count(id, messages, int(number))
+
+        return rolling
+
+
+def _add(counts, id, amount):
+    messages = counts.get(id, 0) + amount
+    if messages:
+        counts[id] = messages
+    else:
+        counts.pop(id, None)
+
+
+class Activity:
+    # recent activity of every guild, one set of rolling counters per
+    # resolution used by WINDOWS. when running sharded every process saves its
+    # own file and `owns` picks its guilds out of all of them
+
+    def __init__(self, filename=ACTIVITY, owns=None):
+        self.filename = filename
+        self.owns = owns
+        self.resolutions = {}
+        for name, (span, length) in WINDOWS.items():
+            self.resolutions.setdefault(span, {})[name] = length
+        self.guilds = {}
+        self._load()
+
+    def _load(self):
+        if self.owns is None:
+            filenames = [self.filename]
+        else:
+            # the newest copy of a guild wins if the shards were regrouped
+            filenames = sorted(glob.glob("activity*.json"), key=os.path.getmtime)
+
+        for filename in filenames:
+            try:
+                with open(filename, "r") as f:
+                    self._read(json.load(f))
+            except FileNotFoundError:
+                pass
+
+    def _read(self, saved):
+        for server, resolutions in saved.items():
+            if self.owns is not None and not self.owns(server):
+                continue
+
+            self.guilds[server] = {
+                int(span): Rolling.load(int(span), self.resolutions[int(span)], buckets)
+                for span, buckets in resolutions.items()
+                if int(span) in self.resolutions
+            }
+
+    def guild(self, server):
+        try:
+            return self.guilds[server]
+        except KeyError:
+            guild = self.guilds[server] = {
+                span: Rolling(span, windows)
+                for span, windows in self.resolutions.items()
+            }
+            return guild
+
+    def rolling(self, server, window):
+        # the counters a window is read from
+        return self.guild(server)[WINDOWS[window][0]]
+
+    def count(self, server, id, amount=1, when=None):
+        for rolling in self.guild(server).values():
+            rolling.count(id, amount, when)
+
+    def get(self, server, window):
+        # messages of every user in the window, {id: messages}
+        return self.rolling(server, window).get(window)
+
+    async def save(self):
+        # writes every guild's buckets in a thread
+        data = json.dumps(
+            {
+                server: {span: rolling.dump() for span, rolling in guild.items()}
+                for server, guild in self.guilds.items()
+            },
+            separators=(",", ":"),
+        )
+        await asyncio.get_event_loop().run_in_executor(None, self._write, data)
+
+    def _write(self, data):
+        with open(f"{self.filename}.tmp", "w") as f:
+            f.write(data)
+        os.replace(f"{self.filename}.tmp", self.filename)
+
+
+class WindowTotals:
+    # messages of a window added up like AltIndex does, so a Leaderboard can
+    # rank them with the usual alt and bot rules
+
+    def __init__(self, alts, counts):
+        self.alts = alts
+        self.totals = {}
+
+        for id, messages in counts.items():
+            _add(self.totals, id, messages)
+            owner = alts.owner(id)
+            if owner is not None:
+                _add(self.totals, owner, messages)
+
+    def owner(self, id):
+        return self.alts.owner(id)
+
+    def total(self, id):
+        return self.totals.get(id, 0)
@@ -0,0 +1,81 @@
+class AltIndex:
+    # alt groups of a single guild: alt -> owner, owner -> alts and the
+    # combined amount of messages of every group, so none of them need a scan
+
+    def __init__(self, msg_dic):
+        self.msg_dic = msg_dic
+        self.owners = {}
+        self.groups = {}
+        self.totals = {}
+
+        for id in msg_dic:
+            for alt in msg_dic[id]["alt"] or ():
+                self.owners[alt] = id
+                self.groups.setdefault(id, []).append(alt)
+
+        for id in self.groups:
+            self._sum(id)
+
+    def owner(self, id):
+        # returns the user `id` is an alt of (or None)
+        return self.owners.get(id)
+
+    def alts(self, id):
+        return self.groups.get(id, [])
+
+    def total(self, id):
+        # messages of a user plus the messages of its alts
+        if id in self.totals:
+            return self.totals[id]
+
+        return self.msg_dic[id]["messages"]
+
+    def add(self, id, amount):
+        # keeps the group totals up to date when a user's messages change
+        if id in self.totals:
+            self.totals[id] += amount
+
+        owner = self.owners.get(id)
+        if owner is not None:
+            self.totals[owner] += amount
+
+    def link(self, owner, alt):
+        if self.owners.get(alt) != owner:
+            self.owners[alt] = owner
+            self.groups.setdefault(owner, []).append(alt)
+
+        self._sum(owner)
+
+    def unlink(self, owner, alt):
+        group = self.groups.get(owner, [])
+        if alt in group:
+            group.remove(alt)
+            del self.owners[alt]
+
+        if group:
+            self._sum(owner)
+        else:
+            self.groups.pop(owner, None)
+            self.totals.pop(owner, None)
+
+    def refresh(self, id):
+        # recomputes the group of a user whose messages were replaced or
+        # who was deleted from the leaderboard
+        if id in self.owners:
+            self._sum(self.owners[id])
+
+        if id not in self.msg_dic and id in self.groups:
+            for alt in self.groups.pop(id):
+                del self.owners[alt]
+            del self.totals[id]
+
+        elif id in self.groups:
+            self._sum(id)
+
+    def _sum(self, id):
+        messages = self.msg_dic[id]["messages"]
+        for alt in self.groups[id]:
+            if alt in self.msg_dic:
+                messages += self.msg_dic[alt]["messages"]
+
+        self.totals[id] = messages
@@ -0,0 +1,79 @@
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+
+# milliseconds between the unix epoch and the first discord snowflake
+DISCORD_EPOCH = 1420070400000
+
+# messages remembered at most (24 bytes each once packed)
+CAPACITY = 2_000_000
+
+# messages packed together, they are kept in a dict until the chunk is full
+CHUNK = 8192
+
+# discord can only bulk delete messages younger than two weeks
+MAX_AGE = 14 * 86400
+
+
+def snowflake_time(id):
+    # seconds since the unix epoch an id was created at
+    return ((id >> 22) + DISCORD_EPOCH) / 1000
+
+
+def time_snowflake(seconds):
+    # smallest id created at `seconds`
+    return int(seconds * 1000 - DISCORD_EPOCH) << 22
+
+
+class AuthorIndex:
+    # guild and author of the recent messages the bot counted, so deletions
+    # of messages that left discord.py's cache can still be taken off their
+    # author. full chunks are packed in sorted arrays, searched by bisection,
+    # and dropped whole when there are too many or they got too old
+
+    def __init__(self, capacity=CAPACITY, chunk=CHUNK, max_age=MAX_AGE):
+        self.chunk = chunk
+        self.max_chunks = max(capacity // chunk, 1)
+        self.max_age = max_age
+        self.recent = {}  # message -> (guild, author)
+        self.chunks = deque()  # (messages, guilds, authors), oldest first
+
+    def __len__(self):
+        return len(self.recent) + sum(len(chunk[0]) for chunk in self.chunks)
+
+    def add(self, message, guild, author):
+        self.recent[message] = (guild, author)
+        if len(self.recent) >= self.chunk:
+            self._pack()
+
+    def _pack(self):
+        messages = array("Q", sorted(self.recent))
+        guilds = array("Q", (self.recent[message][0] for message in messages))
+        authors = array("Q", (self.recent[message][1] for message in messages))
+        self.chunks.append((messages, guilds, authors))
+        self.recent = {}
+
+        oldest = time_snowflake(time.time() - self.max_age)
+        while self.chunks and (
+            len(self.chunks) > self.max_chunks or self.chunks[0][0][-1] < oldest
+        ):
+            self.chunks.popleft()
+
+    def pop(self, message):
+        # (guild, author) of a message, which is forgotten so that it can't
+        # be taken off twice. None if the message isn't known
+        try:
+            return self.recent.pop(message)
+        except KeyError:
+            pass
+
+        for messages, guilds, authors in reversed(self.chunks):
+            if messages[0] <= message <= messages[-1]:
+                index = bisect_left(messages, message)
+                if messages[index] == message and authors[index]:
+                    author = authors[index]
+                    authors[index] = 0
+                    return guilds[index], author
+
+        return None
@@ -0,0 +1,151 @@
+import asyncio
+import json
+import os
+import time
+
+import discord
+
+from records import Member
+from utils import count_message, guild_settings, refresh_user
+
+BACKFILLS = "backfills"
+
+# channels scanned at the same time
+WORKERS = 4
+
+# seconds between two checkpoints
+INTERVAL = 5
+
+
+class Backfill:
+    # counts the messages that were sent before the bot started tracking a
+    # server (`before`, when it joined). channels are scanned a few at a time
+    # (discord.py waits out the rate limits), the counts are kept in memory and
+    # checkpointed with the progress of every channel, so an interrupted scan
+    # resumes where it stopped. nothing changes on the leaderboard until every
+    # channel is done, then the counts are added to what the bot counted itself
+
+    def __init__(self, bot, server, before, directory=BACKFILLS, workers=WORKERS):
+        self.bot = bot
+        self.server = server
+        self.directory = directory
+        self.path = os.path.join(directory, f"{server}.json")
+        self.workers = workers
+        self.state = self._load(before)
+        self._saved = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _load(self, before):
+        # a resumed scan keeps the point it stops at
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            pass
+
+        return {
+            "before": discord.utils.time_snowflake(before),
+            "channels": {},  # channel -> id of the last message scanned
+            "done": [],
+            "counts": {},
+            "names": {},
+            "bots": [],
+        }
+
+    async def run(self, channels):
+        # scans the channels and applies the counts, returns how many users
+        # were updated
+        queue = asyncio.Queue()
+        for channel in channels:
+            if str(channel.id) not in self.state["done"]:
+                queue.put_nowait(channel)
+
+        workers = [
+            asyncio.ensure_future(self._worker(queue)) for _ in range(self.workers)
+        ]
+        try:
+            await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await self.save()
+
+        users = self.apply()
+        os.remove(self.path)
+        return users
+
+    async def _worker(self, queue):
+        while not queue.empty():
+            channel = queue.get_nowait()
+            try:
+                await self._scan(channel)
+            except discord.errors.Forbidden:
+                # channels the bot can't read are left out
+                pass
+            self.state["done"].append(str(channel.id))
+
+    async def _scan(self, channel):
+        state = self.state
+        counts = state["counts"]
+        names = state["names"]
+        last = state["channels"].get(str(channel.id))
+
+        async for message in channel.history(
+            limit=None,
+            before=discord.Object(state["before"]),
+            after=discord.Object(last) if last else None,
+            oldest_first=True,
+        ):
+            author = message.author
+            id = str(author.id)
+            counts[id] = counts.get(id, 0) + 1
+            names[id] = author.name
+            if author.bot and id not in state["bots"]:
+                state["bots"].append(id)
+            state["channels"][str(channel.id)] = message.id
+
+            if time.monotonic() - self._saved >= INTERVAL:
+                await self.save()
+
+    async def save(self):
+        # writes the checkpoint in a thread, the state is encoded on the loop
+        # so the counts always match the progress of the channels
+        self._saved = time.monotonic()
+        data = json.dumps(self.state)
+        async with self._lock:
+            await asyncio.get_event_loop().run_in_executor(None, self._write, data)
+
+    def _write(self, data):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(f"{self.path}.tmp", "w") as f:
+            f.write(data)
+        os.replace(f"{self.path}.tmp", self.path)
+
+    def apply(self):
+        # every user seen in the history gets the messages found there added,
+        # the bot counted the later ones itself
+        server = self.server
+        msg_dic = self.bot.msg_dic[server]
+        bots = set(self.state["bots"])
+        settings = guild_settings(self.bot, server)
+        users = 0
+
+        for id, messages in self.state["counts"].items():
+            if id in msg_dic:
+                count_message(self.bot, server, id, messages)
+
+            elif settings.listen_to_all:
+                msg_dic[id] = Member(
+                    messages, self.state["names"][id], is_bot=id in bots
+                )
+                refresh_user(self.bot, server, id)
+
+            else:
+                continue
+
+            users += 1
+
+        # the same messages would be added again by another scan
+        settings.backfilled = True
+        self.bot.settings.save()
+        return users
@@ -0,0 +1,89 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metrics import metrics
+from persistence import snapshot_guild
+from records import member_hook
+
+BACKUPS = "backups"
+
+# how many backups are kept for every server
+KEEP = 7
+
+
+class Backups:
+    # compressed per-server backups made from memory, only servers that
+    # changed since their last backup are written again
+
+    def __init__(self, msg_dic, directory=BACKUPS, keep=KEEP, workers=4):
+        self.msg_dic = msg_dic
+        self.directory = directory
+        self.keep = keep
+        self.changed = set(msg_dic)
+        self._executor = ThreadPoolExecutor(workers)
+
+    def mark(self, server):
+        self.changed.add(server)
+
+    def history(self, server):
+        # backups of a server, newest first
+        try:
+            files = os.listdir(os.path.join(self.directory, server))
+        except FileNotFoundError:
+            return []
+
+        files = sorted(file for file in files if file.endswith(".json.gz"))
+        return [os.path.join(self.directory, server, file) for file in reversed(files)]
+
+    async def run(self):
+        # returns how many servers were backed up, evicted servers are loaded
+        # again to be copied
+        changed = list(self.changed)
+        self.changed = set()
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        loop = asyncio.get_event_loop()
+
+        jobs = [
+            loop.run_in_executor(
+                self._executor,
+                self._write,
+                server,
+                stamp,
+                snapshot_guild(self.msg_dic[server]),
+            )
+            for server in changed
+        ]
+        with metrics.timer("backup_seconds"):
+            results = await asyncio.gather(*jobs, return_exceptions=True)
+
+        for server, result in zip(changed, results):
+            if isinstance(result, Exception):
+                # tries again on the next backup
+                self.changed.add(server)
+            else:
+                metrics.inc("bytes_written_total", result, file="backup")
+
+        return sum(1 for result in results if not isinstance(result, Exception))
+
+    def _write(self, server, stamp, guild):
+        os.makedirs(os.path.join(self.directory, server), exist_ok=True)
+        path = os.path.join(self.directory, server, f"{stamp}.json.gz")
+
+        with gzip.open(f"{path}.tmp", "wt") as f:
+            json.dump(guild, f, separators=(",", ":"))
+        os.replace(f"{path}.tmp", path)
+
+        for old in self.history(server)[self.keep :]:
+            os.remove(old)
+
+        return os.path.getsize(path)
+
+    def restore(self, server, backup=0):
+        # reads one of a server's backups (0 is the newest)
+        path = self.history(server)[backup]
+        with gzip.open(path, "rt") as f:
+            return json.load(f, object_hook=member_hook)
@@ -0,0 +1,220 @@
+# offline benchmarks of the core commands and events on synthetic guilds
+#
+#   python benchmarks/core.py [--sizes 1000,100000,1000000] [--alts 0.02]
+#                             [--bots 0.01] [--repeat 50] [--output file.json]
+#                             [--compare old.json]
+#
+# needs discord.py installed (main.py is imported), but never connects: the
+# commands get stand-in contexts and messages instead. the bot's files are
+# written to a temporary directory
+
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datasets import generate
+from settings import GuildSettings
+from standins import Context, Guild, Message, User
+
+SERVER = "100000000000000000"
+
+
+def load_bot(directory):
+    # imports main.py inside an empty directory with a dummy token
+    os.chdir(directory)
+    with open("secrets.json", "w") as f:
+        json.dump({"token": "benchmark"}, f)
+
+    import main
+
+    return main
+
+
+def install(main, guild):
+    # swaps the benchmark guild in and drops the indexes built from the old one
+    bot = main.bot
+    bot.msg_dic[SERVER] = guild
+    bot.settings.guilds[SERVER] = GuildSettings(minimum=20000)
+    for indexes in (bot.alts, bot.names, bot.ranks, bot.boards, bot.stats):
+        indexes.pop(SERVER, None)
+
+
+async def timed(func, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        times.append(time.perf_counter() - start)
+
+    times.sort()
+    return {
+        "mean_ms": statistics.fmean(times) * 1000,
+        "p50_ms": times[len(times) // 2] * 1000,
+        "p95_ms": times[min(int(len(times) * 0.95), len(times) - 1)] * 1000,
+        "ops_per_s": len(times) / sum(times) if sum(times) else None,
+    }
+
+
+async def peak(func):
+    tracemalloc.start()
+    await func()
+    result = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result
+
+
+async def run_size(main, members, args):
+    bot = main.bot
+    rng = random.Random(members)
+    guild = generate(members, args.alts, args.bots)
+    install(main, guild)
+
+    server = Guild(SERVER)
+    ids = list(guild)
+    alts = [id for id in ids if guild[id]["is_alt"]]
+    users = [id for id in ids if not guild[id]["is_alt"]]
+
+    def ctx(id=None):
+        id = id or rng.choice(ids)
+        return Context(User(id, guild[id]["name"]), server)
+
+    async def build():
+        install(main, guild)
+        main.get_ranking(bot, SERVER)
+        main.get_names(bot, SERVER)
+
+    async def msglb():
+        await main.msglb.callback(ctx())
+
+    async def msgstats():
+        # a change in between so the stats are computed again every time
+        bot.versions[SERVER] = bot.versions.get(SERVER, 0) + 1
+        await main.msgstats.callback(ctx())
+
+    async def msg():
+        await main.msg.callback(ctx(), guild[rng.choice(ids)]["name"])
+
+    async def altinfo():
+        await main.altinfo.callback(ctx(), guild[rng.choice(alts or ids)]["name"])
+
+    async def rank():
+        user = rng.choice(ids)
+        await main.rank.callback(ctx(), User(user, guild[user]["name"]))
+
+    async def on_message():
+        for i in range(args.messages):
+            id = rng.choice(ids)
+            message = Message(i, User(id, guild[id]["name"]), server, "hello")
+            await main.on_message(message)
+        bot.ingest.apply()
+
+    async def alt_handler():
+        user, alt = rng.sample(users, 2)
+        context = ctx(user)
+        user, alt = User(user, guild[user]["name"]), User(alt, guild[alt]["name"])
+        main.alt_handler(bot, context, user, alt)
+        main.alt_handler(bot, context, user, alt, add=False)
+
+    async def flush():
+        bot.storage.mark(SERVER)
+        await bot.storage.flush()
+
+    operations = {
+        "index_build": (build, 1),
+        "msglb": (msglb, args.repeat),
+        "msgstats": (msgstats, args.repeat),
+        "msg": (msg, args.repeat),
+        "altinfo": (altinfo, args.repeat),
+        "rank": (rank, args.repeat),
+        "on_message": (on_message, 1),
+        "alt_handler": (alt_handler, args.repeat),
+        "flush": (flush, max(args.repeat // 10, 1)),
+    }
+
+    results = {}
+    for name, (func, repeat) in operations.items():
+        result = await timed(func, repeat)
+        result["peak_bytes"] = await peak(func)
+        if name == "on_message":
+            result["ops_per_s"] = args.messages / (result["mean_ms"] / 1000)
+        results[name] = result
+
+        print(
+            f"{members:>8} {name:<12} p50 {result['p50_ms']:9.3f}ms "
+            f"p95 {result['p95_ms']:9.3f}ms {result['ops_per_s'] or 0:12.1f}/s "
+            f"peak {result['peak_bytes'] / 1024 / 1024:8.1f}MB"
+        )
+
+    return results
+
+
+def compare(old, new):
+    # prints how much the median latency of every operation changed
+    for size, operations in new["results"].items():
+        for name, result in operations.items():
+            try:
+                before = old["results"][size][name]["p50_ms"]
+            except KeyError:
+                continue
+
+            change = (result["p50_ms"] - before) * 100 / before if before else 0
+            print(
+                f"{size:>8} {name:<12} {before:9.3f}ms -> {result['p50_ms']:9.3f}ms "
+                f"({change:+.1f}%)"
+            )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmarks")
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--alts", type=float, default=0.02)
+    parser.add_argument("--bots", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument(
+        "--output", default=f"benchmark-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    parser.add_argument("--compare")
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    previous = os.path.abspath(args.compare) if args.compare else None
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_main = load_bot(directory)
+        loop = asyncio.get_event_loop()
+        results = {}
+        for size in map(int, args.sizes.split(",")):
+            results[str(size)] = loop.run_until_complete(run_size(bot_main, size, args))
+
+    report = {
+        "meta": {
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "machine": platform.machine(),
+            "args": vars(args),
+        },
+        "results": results,
+    }
+    with open(output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"results saved to {output}")
+
+    if previous:
+        with open(previous, "r") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
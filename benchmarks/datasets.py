@@ -0,0 +1,37 @@
+# synthetic guilds for the benchmarks, message counts follow a long tail like
+# real servers (a few very active users and a lot of quiet ones)
+
+import random
+import string
+
+from records import Member
+
+
+def generate(members, alts=0.02, bots=0.01, seed=0):
+    # returns a guild (id -> Member) with the given ratio of alts and bots
+    rng = random.Random(seed)
+    ids = set()
+    while len(ids) < members:
+        ids.add(str(rng.randrange(10**17, 10**18)))
+
+    guild = {}
+    for i, id in enumerate(ids):
+        name = "".join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 10)))
+        guild[id] = Member(
+            int(rng.paretovariate(1.1) * 10),
+            f"{name}{i}",
+            is_bot=rng.random() < bots,
+        )
+
+    # alts are attached to random users that aren't alts themselves
+    ids = list(guild)
+    rng.shuffle(ids)
+    count = int(members * alts)
+    for alt, owner in zip(ids[:count], rng.choices(ids[count:], k=count)):
+        guild[alt]["is_alt"] = True
+        if guild[owner]["alt"] is None:
+            guild[owner]["alt"] = [alt]
+        else:
+            guild[owner]["alt"].append(alt)
+
+    return guild
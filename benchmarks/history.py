@@ -0,0 +1,180 @@
+# checks -backfill against stand-in channels: a scan is interrupted halfway,
+# resumed from its checkpoint in backfills/<server>.json, and the counts it
+# ends with are compared with the messages each user sent before the bot
+# joined. one channel can't be read and every channel also has messages sent
+# after the bot joined, which were already counted and must not be added
+#
+#   python benchmarks/history.py [--members 200] [--channels 6]
+#                                [--messages 2000] [--interrupt 300]
+#
+# needs discord.py installed (main.py is imported)
+
+import argparse
+import asyncio
+import datetime
+import os
+import random
+import sys
+import tempfile
+
+import discord
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core import SERVER, load_bot
+from datasets import generate
+from settings import GuildSettings
+from standins import Channel, Guild, Message, User
+
+# when the stand-in bot joined the guild
+JOINED = datetime.datetime(2024, 1, 1)
+# id of the channel the bot can see but not read the history of
+HIDDEN = 1
+
+
+class Response:
+    # what discord.errors.Forbidden reads from the http response
+    status = 403
+    reason = "Forbidden"
+
+
+class HiddenChannel(Channel):
+    # a channel without the read message history permission
+    async def history(self, **kwargs):
+        raise discord.errors.Forbidden(Response(), "Missing Access")
+        yield
+
+
+class FlakyChannel(Channel):
+    # a channel whose history stops with an error after `limit` messages, like
+    # a connection lost in the middle of the scan
+    def __init__(self, id, messages, limit):
+        super().__init__(id, messages)
+        self.limit = limit
+
+    async def history(self, **kwargs):
+        sent = 0
+        async for message in super().history(**kwargs):
+            if sent == self.limit:
+                raise ConnectionError("connection lost")
+            sent += 1
+            yield message
+
+
+def snowflake(rng, after):
+    # id of a message sent up to a year before (or a month after) JOINED
+    if after:
+        delta = datetime.timedelta(seconds=rng.randrange(1, 30 * 86400))
+        at = JOINED + delta
+    else:
+        at = JOINED - datetime.timedelta(seconds=rng.randrange(1, 365 * 86400))
+    return discord.utils.time_snowflake(at) + rng.randrange(1 << 22)
+
+
+def synthesize(args, guild):
+    # channels of messages from tracked users, new users and a bot, and the
+    # number of messages each author sent before JOINED in the readable ones
+    rng = random.Random(args.seed)
+    guild_stand_in = Guild(SERVER)
+    authors = [User(id, user["name"]) for id, user in list(guild.items())[:50]]
+    authors += [User(10**17 + number, f"new{number}") for number in range(20)]
+    authors.append(User(10**17 - 1, "somebot", bot=True))
+
+    channels = []
+    expected = {}
+    for number in range(args.channels):
+        id = HIDDEN + number
+        messages = []
+        for _ in range(args.messages):
+            author = rng.choice(authors)
+            after = rng.random() < 0.2
+            messages.append(
+                Message(snowflake(rng, after), author, guild_stand_in, "hello")
+            )
+            if id != HIDDEN and not after:
+                expected[str(author.id)] = expected.get(str(author.id), 0) + 1
+
+        messages.sort(key=lambda message: message.id)
+        kind = HiddenChannel if id == HIDDEN else Channel
+        channels.append(kind(id, messages))
+
+    return channels, expected
+
+
+async def scan(main, args):
+    from backfill import Backfill
+
+    bot = main.bot
+    guild = bot.msg_dic[SERVER]
+    channels, expected = synthesize(args, guild)
+    before = {id: user["messages"] for id, user in guild.items()}
+    errors = []
+
+    # the first scan loses its connection in one of the channels
+    flaky = channels[1]
+    channels[1] = FlakyChannel(flaky.id, flaky.messages, args.interrupt)
+    try:
+        await Backfill(bot, SERVER, JOINED, workers=2).run(channels)
+        errors.append("the interrupted scan didn't stop")
+    except ConnectionError:
+        pass
+
+    path = os.path.join("backfills", f"{SERVER}.json")
+    if not os.path.exists(path):
+        errors.append(f"no checkpoint in {path}")
+    if any(guild[id]["messages"] != messages for id, messages in before.items()):
+        errors.append("the interrupted scan changed the leaderboard")
+
+    # resumed with the channels readable again, and a later time that must be
+    # ignored in favour of the one in the checkpoint
+    channels[1] = flaky
+    job = Backfill(bot, SERVER, datetime.datetime.utcnow(), workers=2)
+    users = await job.run(channels)
+    bot.ingest.apply(SERVER)
+
+    for id, messages in expected.items():
+        got = guild[id]["messages"] if id in guild else 0
+        want = before.get(id, 0) + messages
+        if got != want:
+            errors.append(f"{id} has {got} messages, not {want}")
+    for id, messages in before.items():
+        if guild[id]["messages"] < messages:
+            errors.append(f"{id} went down from {messages} messages")
+    if not guild[str(10**17 - 1)]["is_bot"]:
+        errors.append("the bot found in the history isn't flagged as one")
+    if os.path.exists(path):
+        errors.append(f"{path} wasn't removed")
+    if not bot.settings.guild(SERVER).backfilled:
+        errors.append("the server isn't marked as backfilled")
+
+    return users, sum(expected.values()), errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="-backfill check")
+    parser.add_argument("--members", type=int, default=200)
+    parser.add_argument("--channels", type=int, default=6)
+    parser.add_argument("--messages", type=int, default=2000)
+    parser.add_argument("--interrupt", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_main = load_bot(directory)
+        bot_main.bot.msg_dic[SERVER] = generate(args.members, seed=args.seed)
+        bot_main.bot.settings.guilds[SERVER] = GuildSettings()
+        loop = asyncio.get_event_loop()
+        users, messages, errors = loop.run_until_complete(scan(bot_main, args))
+        os.chdir(ROOT)
+
+    print(f"{messages} messages counted for {users} users")
+    if errors:
+        print("\n".join(errors[:20]))
+        sys.exit(f"{len(errors)} differences")
+    print("every user got the messages they sent before the bot joined")
+
+
+if __name__ == "__main__":
+    main()
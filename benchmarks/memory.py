@@ -0,0 +1,56 @@
+# compares the memory used by a guild stored as plain dicts (the old layout)
+# and as Member records
+#
+#   python benchmarks/memory.py [members]
+
+import os
+import random
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from records import Member
+
+
+def as_dict(messages, name, alt, is_alt, is_bot):
+    return {
+        "messages": messages,
+        "name": name,
+        "alt": alt,
+        "is_alt": is_alt,
+        "is_bot": is_bot,
+    }
+
+
+def measure(make, users):
+    tracemalloc.start()
+    guild = {id: make(*user) for id, user in users}
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del guild
+    return size
+
+
+def main(members=100000):
+    rng = random.Random(0)
+    users = [
+        (
+            str(rng.randrange(10**17, 10**18)),
+            (rng.randrange(50000), f"user{i}", None, False, rng.random() < 0.01),
+        )
+        for i in range(members)
+    ]
+
+    dict_size = measure(as_dict, users)
+    member_size = measure(Member, users)
+
+    # the ids and names are shared, so only the containers get measured
+    print(f"{members} members")
+    print(f"dict:   {dict_size / members:7.1f} bytes per member")
+    print(f"Member: {member_size / members:7.1f} bytes per member")
+    print(f"saved:  {100 - member_size * 100 / dict_size:.0f}%")
+
+
+if __name__ == "__main__":
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,318 @@
+# replays a stream of gateway events (messages, deletes and commands) at a
+# fixed rate against the bot, to see how commands respond while on_message
+# absorbs a storm and the storage keeps writing
+#
+#   python benchmarks/replay.py [--guilds 20] [--members 5000] [--rate 2000]
+#                               [--duration 30] [--commands 0.005]
+#                               [--deletes 0.02] [--record events.jsonl]
+#                               [--replay events.jsonl] [--output file.json]
+#
+# every event is dispatched as its own task like discord.py does, so the
+# latency of a command includes the time it waited for the loop. commands are
+# sent as messages through on_message, so they are parsed, converted, checked
+# and hooked like real ones. needs discord.py installed, but never connects
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from functools import partial
+
+import discord
+from discord.ext import commands
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from core import load_bot
+from datasets import generate
+from settings import GuildSettings
+from standins import Guild, Message, User
+
+# seconds between two samples of the event loop lag
+TICK = 0.01
+# id of the stand-in bot user
+BOT = 1
+
+COMMANDS = ("msglb", "msg", "edit", "rank")
+
+
+class Payload:
+    # raw delete event
+    def __init__(self, guild_id, message_id):
+        self.guild_id = guild_id
+        self.message_id = message_id
+
+
+class Moderator(User):
+    # command authors are allowed to use every command
+    guild_permissions = discord.Permissions(manage_channels=True)
+
+
+class CommandMessage(Message):
+    # message holding a command, remembers when it was sent
+    _state = None
+
+    def __init__(self, id, author, guild, content, mentions, latencies, name):
+        super().__init__(id, author, guild, content)
+        self.mentions = mentions
+        self.latencies = latencies
+        self.name = name
+        self.started = time.perf_counter()
+        self.answered = False
+
+
+class TimedContext(commands.Context):
+    # real context (so the command goes through its converters, checks and
+    # hooks) that keeps what it sends and when the command first answered
+    async def send(self, content=None, **kwargs):
+        message = self.message
+        if not message.answered:
+            message.answered = True
+            message.latencies[message.name].append(
+                time.perf_counter() - message.started
+            )
+        return Message(0, self.bot.user, message.guild, content or "")
+
+
+def prepare(bot):
+    # the bot never logs in, so it gets a stand-in user and its contexts can't
+    # reach discord
+    bot._connection.user = User(BOT, "bot", bot=True)
+    bot.get_context = partial(bot.get_context, cls=TimedContext)
+
+
+def synthesize(args, guilds):
+    # events as (time, type, guild, fields), time in seconds from the start
+    rng = random.Random(args.seed)
+    servers = list(guilds)
+    members = {server: list(guilds[server]) for server in servers}
+    sent = {server: [] for server in servers}
+    message = 10**17
+
+    for number in range(int(args.rate * args.duration)):
+        at = number / args.rate
+        # a few servers get most of the traffic
+        server = servers[min(int(rng.paretovariate(1.2)) - 1, len(servers) - 1)]
+        roll = rng.random()
+
+        if roll < args.commands:
+            command = rng.choice(COMMANDS)
+            target = rng.choice(members[server])
+            message += 1
+            yield at, "command", server, {
+                "author": rng.choice(members[server]),
+                "message": message,
+                "command": command,
+                "target": target,
+                "name": guilds[server][target]["name"],
+                "messages": rng.randrange(10**5),
+            }
+
+        elif roll < args.commands + args.deletes and sent[server]:
+            yield at, "delete", server, {"message": sent[server].pop()}
+
+        else:
+            message += 1
+            sent[server].append(message)
+            yield at, "message", server, {
+                "author": rng.choice(members[server]),
+                "message": message,
+            }
+
+
+def record(events, path):
+    with open(path, "w") as f:
+        for at, kind, server, fields in events:
+            f.write(
+                json.dumps({"t": at, "type": kind, "guild": server, **fields}) + "\n"
+            )
+
+
+def recorded(path):
+    with open(path, "r") as f:
+        for line in f:
+            event = json.loads(line)
+            yield event.pop("t"), event.pop("type"), event.pop("guild"), event
+
+
+async def dispatch(main, kind, server, fields, latencies):
+    guild = Guild(server)
+
+    if kind == "message":
+        author = User(fields["author"], f"user{fields['author']}")
+        await main.on_message(Message(fields["message"], author, guild, "hello"))
+
+    elif kind == "delete":
+        await main.on_raw_message_delete(Payload(int(server), fields["message"]))
+
+    else:
+        command = fields["command"]
+        author = Moderator(fields["author"], f"user{fields['author']}")
+        target = User(fields["target"], fields["name"])
+        mentions = []
+
+        if command == "msglb":
+            content = "-msglb"
+        elif command == "msg":
+            content = f"-msg {fields['name']}"
+        elif command == "rank":
+            content = f"-rank <@{target.id}>"
+            mentions.append(target)
+        else:
+            content = f"-edit <@{target.id}> {fields['messages']}"
+            mentions.append(target)
+
+        # recordings made before commands had a message id get 0
+        message = CommandMessage(
+            fields.get("message", 0),
+            author,
+            guild,
+            content,
+            mentions,
+            latencies,
+            command,
+        )
+        await main.on_message(message)
+
+
+async def monitor(lags, stop):
+    # how late the loop wakes up a task that asked to sleep TICK seconds
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+def percentiles(values):
+    if not values:
+        return None
+
+    values = sorted(values)
+    pick = lambda q: values[min(int(len(values) * q), len(values) - 1)] * 1000
+    return {
+        "count": len(values),
+        "mean_ms": statistics.fmean(values) * 1000,
+        "p50_ms": pick(0.5),
+        "p95_ms": pick(0.95),
+        "p99_ms": pick(0.99),
+        "max_ms": values[-1] * 1000,
+    }
+
+
+async def replay(main, events):
+    bot = main.bot
+    prepare(bot)
+    latencies = {command: [] for command in COMMANDS}
+    lags = []
+    tasks = set()
+    counts = {"message": 0, "delete": 0, "command": 0}
+    stop = asyncio.Event()
+    watcher = asyncio.ensure_future(monitor(lags, stop))
+    received = bot.ingest.received
+
+    start = time.perf_counter()
+    for at, kind, server, fields in events:
+        delay = start + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        task = asyncio.ensure_future(dispatch(main, kind, server, fields, latencies))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        counts[kind] += 1
+
+    await asyncio.gather(*tasks)
+    bot.ingest.apply()
+    elapsed = time.perf_counter() - start
+    await bot.storage.flush()
+    stop.set()
+    await watcher
+
+    return {
+        "elapsed_s": elapsed,
+        "events": counts,
+        "ingest_per_s": counts["message"] / elapsed,
+        "applied_per_s": (bot.ingest.received - received) / elapsed,
+        "loop_lag": percentiles(lags),
+        "commands": {
+            command: percentiles(values) for command, values in latencies.items()
+        },
+    }
+
+
+def report(result):
+    print(
+        f"{result['elapsed_s']:.1f}s, {result['events']['message']} messages "
+        f"({result['ingest_per_s']:.0f}/s), {result['events']['delete']} deletes, "
+        f"{result['events']['command']} commands"
+    )
+    rows = [("loop lag", result["loop_lag"])] + list(result["commands"].items())
+    for name, stats in rows:
+        if stats is None:
+            continue
+        print(
+            f"{name:<10} p50 {stats['p50_ms']:8.2f}ms p95 {stats['p95_ms']:8.2f}ms "
+            f"p99 {stats['p99_ms']:8.2f}ms max {stats['max_ms']:8.2f}ms "
+            f"({stats['count']})"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="gateway replay load test")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--members", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=2000)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--commands", type=float, default=0.005)
+    parser.add_argument("--deletes", type=float, default=0.02)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--record")
+    parser.add_argument("--replay")
+    parser.add_argument(
+        "--output", default=f"replay-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    args = parser.parse_args()
+    output = os.path.abspath(args.output)
+    recording = os.path.abspath(args.record) if args.record else None
+    replaying = os.path.abspath(args.replay) if args.replay else None
+
+    guilds = {
+        str(10**17 + number): generate(args.members, seed=number)
+        for number in range(args.guilds)
+    }
+    if replaying:
+        # the recorded events need the guilds they were recorded with
+        with open(replaying, "r") as f:
+            servers = {json.loads(line)["guild"] for line in f}
+        guilds = {server: guilds.get(server, {}) for server in servers}
+
+    if recording:
+        record(synthesize(args, guilds), recording)
+        print(f"events saved to {recording}")
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_main = load_bot(directory)
+        for server, guild in guilds.items():
+            bot_main.bot.msg_dic[server] = guild
+            bot_main.bot.settings.guilds[server] = GuildSettings()
+
+        events = recorded(replaying) if replaying else synthesize(args, guilds)
+        result = asyncio.get_event_loop().run_until_complete(replay(bot_main, events))
+
+    result["meta"] = {"time": time.strftime("%Y-%m-%dT%H:%M:%S"), "args": vars(args)}
+    report(result)
+    with open(output, "w") as f:
+        json.dump(result, f, indent=4)
+    print(f"results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
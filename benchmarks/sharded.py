@@ -0,0 +1,237 @@
+# checks the sharded mode with local stand-in shards: a few processes are
+# started the way shards.py starts them, but they never connect. each one
+# counts messages and changes the settings of the guilds its shards own, all
+# of them writing to one messages.db, and the results are compared with what
+# every guild should end up with
+#
+#   python benchmarks/sharded.py [--shards 4] [--processes 2] [--guilds 8]
+#                                [--members 500] [--messages 200]
+#
+# needs discord.py installed (main.py is imported)
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from datasets import generate
+from shards import GROUP, SHARD_COUNT, SHARDS, groups, shard_of
+from standins import Guild, Message, User
+
+# seconds a process waits for the others before giving up
+TIMEOUT = 60
+# minimum a process sets on its guilds is this plus its group
+MINIMUM = 1000
+
+
+def servers(count):
+    # guild ids spread over the shards, the shard is taken from bits 22 and up
+    return [str(((10**17 >> 22) + number) << 22) for number in range(count)]
+
+
+def barrier(name, processes):
+    # waits until every process reached the same point
+    with open(f"{name}.{os.environ[GROUP]}", "w"):
+        pass
+
+    deadline = time.monotonic() + TIMEOUT
+    while len(glob.glob(f"{name}.*")) < processes:
+        if time.monotonic() > deadline:
+            sys.exit(f"timed out waiting for the other processes at {name}")
+        time.sleep(0.05)
+
+
+async def work(main, args):
+    bot = main.bot
+    group = int(os.environ[GROUP])
+    every = list(bot.settings.guilds)
+    owned = [server for server in every if main.owns(server)]
+    rng = random.Random(group)
+
+    # every guild is loaded, so each process holds copies of the others'
+    for server in every:
+        bot.msg_dic[server]
+    barrier("loaded", args.processes)
+
+    counts = {}
+    number = group * 10**9
+    for server in owned:
+        ids = list(bot.msg_dic[server])
+        sent = counts[server] = {}
+        for _ in range(args.messages):
+            id = rng.choice(ids)
+            number += 1
+            author = User(id, bot.msg_dic[server][id]["name"])
+            await main.on_message(Message(number, author, Guild(server), "hello"))
+            sent[id] = sent.get(id, 0) + 1
+
+        bot.settings.guild(server).minimum = MINIMUM + group
+
+    bot.ingest.apply()
+    await bot.storage.flush()
+    bot.settings.save_now()
+    barrier("saved", args.processes)
+
+    # saved again once the others are done, with the settings of their guilds
+    # as they were when this process started
+    bot.settings.save_now()
+    await bot.storage.flush()
+    barrier("resaved", args.processes)
+
+    network = await main.get_network(bot)
+    return {
+        "group": group,
+        "shards": sorted(main.owns.ids),
+        "owned": owned,
+        "counts": counts,
+        "global": sum(network.users.values()),
+    }
+
+
+def worker(args):
+    import main
+
+    loop = asyncio.get_event_loop()
+    result = loop.run_until_complete(work(main, args))
+    with open(f"result.{result['group']}.json", "w") as f:
+        json.dump(result, f)
+
+
+def check(args, guilds, results):
+    # returns what differs from the expected state of messages.db
+    errors = []
+    owners = {}
+    for result in results:
+        for server in result["owned"]:
+            if shard_of(server, args.shards) not in result["shards"]:
+                errors.append(f"{server} owned by group {result['group']} by mistake")
+            owners.setdefault(server, []).append(result)
+
+    for server in guilds:
+        if len(owners.get(server, ())) != 1:
+            errors.append(f"{server} owned by {len(owners.get(server, ()))} groups")
+
+    db = sqlite3.connect("messages.db")
+    for server, guild in guilds.items():
+        if len(owners.get(server, ())) != 1:
+            continue
+
+        owner = owners[server][0]
+        sent = owner["counts"][server]
+        for id, messages in db.execute(
+            "SELECT id, messages FROM members WHERE guild = ?", (int(server),)
+        ):
+            expected = guild[str(id)]["messages"] + sent.get(str(id), 0)
+            if messages != expected:
+                errors.append(f"{server}/{id} has {messages}, not {expected}")
+
+        (data,) = db.execute(
+            "SELECT data FROM settings WHERE guild = ?", (int(server),)
+        ).fetchone()
+        minimum = json.loads(data)["minimum"]
+        if minimum != MINIMUM + owner["group"]:
+            errors.append(f"{server} has minimum {minimum}, set by another group")
+
+    (total,) = db.execute(
+        "SELECT SUM(total) FROM members WHERE is_alt = 0 AND is_bot = 0"
+    ).fetchone()
+    for result in results:
+        if result["global"] != total:
+            errors.append(
+                f"group {result['group']} has {result['global']} messages on the "
+                f"global leaderboard, not {total}"
+            )
+
+    db.close()
+    return errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description="sharded mode check")
+    parser.add_argument("--shards", type=int, default=4)
+    parser.add_argument("--processes", type=int, default=2)
+    parser.add_argument("--guilds", type=int, default=8)
+    parser.add_argument("--members", type=int, default=500)
+    parser.add_argument("--messages", type=int, default=200)
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.processes = max(min(args.processes, args.shards), 1)
+
+    if args.worker:
+        return worker(args)
+
+    guilds = {
+        server: generate(args.members, seed=number)
+        for number, server in enumerate(servers(args.guilds))
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        with open("messages.json", "w") as f:
+            json.dump(
+                {
+                    server: {id: user.to_dict() for id, user in guild.items()}
+                    for server, guild in guilds.items()
+                },
+                f,
+            )
+        with open("settings.json", "w") as f:
+            json.dump({server: {} for server in guilds}, f)
+        # written once, the processes would read each other's half-written file
+        with open("secrets.json", "w") as f:
+            json.dump({"token": "benchmark"}, f)
+
+        import storage
+
+        storage.migrate()
+        os.remove("messages.json")
+
+        children = []
+        for group, ids in enumerate(groups(args.shards, args.processes)):
+            environ = dict(os.environ)
+            environ[SHARDS] = ",".join(map(str, ids))
+            environ[SHARD_COUNT] = str(args.shards)
+            environ[GROUP] = str(group)
+            children.append(
+                subprocess.Popen(
+                    [sys.executable, os.path.abspath(__file__), "--worker"]
+                    + sys.argv[1:],
+                    env=environ,
+                )
+            )
+
+        failed = [child for child in children if child.wait()]
+        if failed:
+            sys.exit(f"{len(failed)} of {len(children)} processes failed")
+
+        results = []
+        for path in sorted(glob.glob("result.*.json")):
+            with open(path, "r") as f:
+                results.append(json.load(f))
+        errors = check(args, guilds, results)
+        os.chdir(ROOT)
+
+    for result in results:
+        print(
+            f"group {result['group']}: shards {result['shards']}, "
+            f"{len(result['owned'])} guilds"
+        )
+    if errors:
+        print("\n".join(errors[:20]))
+        sys.exit(f"{len(errors)} differences")
+    print("every guild has its owner's messages and settings")
+
+
+if __name__ == "__main__":
+    main()
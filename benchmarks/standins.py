@@ -0,0 +1,78 @@
+# stand-ins for the discord objects the commands and events use, so they can
+# be driven without a connection
+
+
+class User:
+    def __init__(self, id, name, bot=False):
+        self.id = int(id)
+        self.name = name
+        self.bot = bot
+
+    def __eq__(self, other):
+        return isinstance(other, User) and other.id == self.id
+
+    def __hash__(self):
+        return self.id
+
+    def __str__(self):
+        return self.name
+
+
+class Guild:
+    def __init__(self, id, channels=()):
+        self.id = int(id)
+        self.text_channels = list(channels)
+
+
+class Channel:
+    # a text channel holding a fixed list of messages, oldest first
+    def __init__(self, id, messages=()):
+        self.id = int(id)
+        self.messages = list(messages)
+
+    async def history(self, limit=100, before=None, after=None, oldest_first=None):
+        messages = [
+            message
+            for message in self.messages
+            if (before is None or message.id < before.id)
+            and (after is None or message.id > after.id)
+        ]
+        if not oldest_first:
+            messages.reverse()
+
+        for message in messages[:limit]:
+            yield message
+
+
+class Message:
+    def __init__(self, id, author, guild, content="", channel=None):
+        self.id = id
+        self.author = author
+        self.guild = guild
+        self.content = content
+        self.channel = channel
+
+    async def add_reaction(self, emoji):
+        pass
+
+    async def remove_reaction(self, emoji, member):
+        pass
+
+    async def clear_reactions(self):
+        pass
+
+    async def edit(self, **kwargs):
+        pass
+
+
+class Context:
+    def __init__(self, author, guild, command=None):
+        self.author = author
+        self.message = Message(0, author, guild)
+        self.guild = guild
+        self.command = command
+        self.sent = []
+
+    async def send(self, content=None, **kwargs):
+        self.sent.append(content if content is not None else kwargs)
+        return Message(len(self.sent), self.author, self.guild, content or "")
@@ -0,0 +1,79 @@
+import asyncio
+import time
+from collections import deque
+
+from utils import count_message
+
+# seconds between two batches of counters being applied
+INTERVAL = 0.5
+
+# seconds of history used to compute the message rate
+WINDOW = 60
+
+
+class Ingest:
+    # message counters of on_message/on_message_delete are buffered per guild
+    # and applied in batches, so a busy user costs one update per batch
+    # instead of one per message
+
+    def __init__(self, bot, interval=INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self.pending = {}  # server -> {id: messages}
+        self.received = 0
+        self.history = deque()  # (time, {server: messages}) of every applied batch
+        self._received = {}  # messages received per guild since the last batch
+        self._task = None
+        self.started = time.monotonic()
+
+    def count(self, server, id, amount=1):
+        try:
+            guild = self.pending[server]
+        except KeyError:
+            guild = self.pending[server] = {}
+
+        guild[id] = guild.get(id, 0) + amount
+        if amount > 0:
+            self._received[server] = self._received.get(server, 0) + amount
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._later())
+
+    async def _later(self):
+        await asyncio.sleep(self.interval)
+        self.apply()
+
+    def apply(self, server=None):
+        # applies the buffered counters of a guild (or of every guild)
+        if server is None:
+            pending, self.pending = self.pending, {}
+        elif server in self.pending:
+            pending = {server: self.pending.pop(server)}
+        else:
+            return
+
+        for server, guild in pending.items():
+            msg_dic = self.bot.msg_dic[server]
+            for id, amount in guild.items():
+                # the user may have been deleted in the meantime
+                if amount and id in msg_dic:
+                    count_message(self.bot, server, id, amount)
+
+        now = time.monotonic()
+        self.received += sum(self._received.values())
+        self.history.append((now, self._received))
+        self._received = {}
+
+        while self.history[0][0] < now - WINDOW:
+            self.history.popleft()
+
+    def rate(self, server=None):
+        # messages per second over the last minute (in a guild or everywhere)
+        now = time.monotonic()
+        elapsed = min(now - self.started, WINDOW)
+        messages = sum(
+            sum(received.values()) if server is None else received.get(server, 0)
+            for applied, received in self.history
+            if applied >= now - WINDOW
+        )
+        return messages / elapsed if elapsed > 0 else 0.0
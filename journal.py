@@ -0,0 +1,130 @@
+import asyncio
+import glob
+import json
+import os
+
+from metrics import metrics
+from records import Member
+from utils import FILENAME
+
+# seconds between two journal writes
+INTERVAL = 1
+
+
+def segments(filename=FILENAME):
+    # existing journal segments as (number, path), oldest first
+    result = []
+    for path in glob.glob(f"{glob.escape(filename)}.*.journal"):
+        number = path[len(filename) + 1 : -len(".journal")]
+        if number.isdecimal():
+            result.append((int(number), path))
+
+    return sorted(result)
+
+
+def replay(msg_dic, filename=FILENAME):
+    # applies the journal on top of the last snapshot, every entry holds the
+    # whole state of a user so entries already in the snapshot are harmless
+    entries = 0
+    for _, path in segments(filename):
+        with open(path, "r") as f:
+            for line in f:
+                try:
+                    server, id, record = json.loads(line)
+                except ValueError:
+                    # last line of a write that got interrupted
+                    continue
+
+                guild = msg_dic.setdefault(server, {})
+                if record is None:
+                    guild.pop(id, None)
+                else:
+                    guild[id] = Member(*record)
+                entries += 1
+
+    return entries
+
+
+def encode(msg_dic, server, id):
+    user = msg_dic.get(server, {}).get(id)
+    if user is None:
+        record = None
+    else:
+        record = [
+            user["messages"],
+            user["name"],
+            user["alt"],
+            user["is_alt"],
+            user["is_bot"],
+        ]
+
+    return json.dumps([server, id, record], separators=(",", ":")) + "\n"
+
+
+class Journal:
+    # append-only log of the users that changed, written in small batches so
+    # a crash only loses the last few seconds instead of everything since the
+    # last snapshot of messages.json
+
+    def __init__(self, msg_dic, filename=FILENAME, interval=INTERVAL):
+        self.msg_dic = msg_dic
+        self.filename = filename
+        self.interval = interval
+        self.pending = {}  # (server, id) -> None, used as an ordered set
+        self.segment = max((number for number, _ in segments(filename)), default=0)
+        self.segment += 1
+        self.bytes_written = 0
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def path(self):
+        return f"{self.filename}.{self.segment}.journal"
+
+    def touch(self, server, id):
+        self.pending[(server, id)] = None
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._later())
+
+    async def _later(self):
+        await asyncio.sleep(self.interval)
+        await self.write()
+
+    async def write(self):
+        # encodes the pending users on the loop and appends them in a thread
+        async with self._lock:
+            await self._write(self.path)
+
+    async def _write(self, path):
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        data = "".join(encode(self.msg_dic, server, id) for server, id in pending)
+        with metrics.timer("journal_write_seconds"):
+            await asyncio.get_event_loop().run_in_executor(
+                None, self._append, path, data
+            )
+        self.bytes_written += len(data)
+        metrics.inc("bytes_written_total", len(data), file="journal")
+
+    def _append(self, path, data):
+        with open(path, "a") as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+
+    async def rotate(self):
+        # starts a new segment, returns the number of the last one
+        async with self._lock:
+            path = self.path
+            self.segment += 1
+            await self._write(path)
+            return self.segment - 1
+
+    def compact(self, segment):
+        # drops the segments that are already part of a snapshot
+        for number, path in segments(self.filename):
+            if number <= segment:
+                os.remove(path)
@@ -1,8 +1,28 @@
-import json
+import asyncio
+import datetime
+import io
+import sys
+import tempfile
+import time
+import typing
 
 import discord
 from discord.ext import commands, tasks
 
+from activity import WINDOWS, Activity
+from backfill import Backfill
+from authors import AuthorIndex, snowflake_time
+from backup import Backups
+from ingest import Ingest
+from metrics import metrics
+from profiling import Profiler, Watchdog
+from records import Member
+from render import PAGE, top_page
+from renames import Renames
+from settings import Settings
+from shards import Ownership, config
+from storage import SQLiteStorage, open_storage
+from transfer import MAX_ERRORS, export, merge, parse
 from utils import *
 
 
@@ -22,33 +42,114 @@ class HelpCmd(commands.HelpCommand):
     send_cog_help = send_command_help = send_group_help = send_bot_help
 
 
-class MsgLeaderBot(commands.Bot):
-    def __init__(self):
+class MsgLeaderBot(commands.AutoShardedBot):
+    def __init__(self, shard_ids=None, shard_count=None, group=0):
         helpattr = {"usage": ""}
+        # username changes and the member cache need the (privileged) members
+        # intent, it has to be turned on in the developer portal too
+        intents = discord.Intents.default()
+        intents.members = True
         super().__init__(
             command_prefix="-",
             help_command=HelpCmd(command_attrs=helpattr),
             allowed_mentions=discord.AllowedMentions.none(),
+            intents=intents,
+            shard_ids=shard_ids,
+            shard_count=shard_count,
         )
+        # number of this process when running sharded (see shards.py)
+        self.group = group
+        # per guild alt groups, names and ranking, built from msg_dic when needed
+        self.alts = {}
+        self.names = {}
+        self.ranks = {}
+        # per guild (and time window) rendered leaderboard and the version of
+        # the data it shows
+        self.boards = {}
+        self.versions = {}
+        # per guild distribution of the messages, kept like the leaderboards
+        self.stats = {}
+        # leaderboard of every guild, built on the first -globallb
+        self.network = None
+        self.network_board = None
+        # build of the global leaderboard that is running, the changes made
+        # during it, and the rows of the other processes' guilds it was built
+        # with when running sharded
+        self.network_task = None
+        self.network_changes = None
+        self.network_foreign = None
+        # history scans that are running, per guild
+        self.backfills = {}
+        self.metrics_server = None
+        # stall watchdog (if "stall_ms" is set) and the profiler of -profile
+        self.watchdog = None
+        self.profiler = Profiler()
         # start json updater and file saver
         self.json_updater.start()
         self.save.start()
+        self.evict.start()
+        self.sweep_names.start()
 
     async def on_ready(self):
         # launch everytime bot is online (not only first boot)
         # just a way to know if the bot is online
         print("Bot online!")
 
-    @tasks.loop(hours=8)
+        # local prometheus endpoint, started on the first boot only
+        port = self.settings.get("metrics_port")
+        if self.metrics_server is None and port:
+            try:
+                self.metrics_server = await metrics.serve(port=int(port) + self.group)
+            except OSError as error:
+                print(f"Metrics endpoint not started: {error}")
+
+        threshold = self.settings.get("stall_ms")
+        if self.watchdog is None and threshold:
+            self.watchdog = Watchdog(threshold / 1000)
+            self.watchdog.start()
+
+    async def close(self):
+        # writes whatever is still pending before shutting down
+        self.ingest.apply()
+        self.renames.apply()
+        self.settings.flush()
+        await self.storage.flush()
+        await self.windows.save()
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        if self.profiler.running:
+            self.profiler.stop()
+        await super().close()
+
+    @tasks.loop(minutes=10)
     async def json_updater(self):
-        # update json every 8 hours
+        # saves every changed server every 10 minutes (changes are already
+        # journaled or committed to the database a second after they happen)
+        self.ingest.apply()
+        await self.storage.flush()
+        await self.windows.save()
+        # the global leaderboard gets the changes of the other processes
+        await refresh_network(self)
         print("Updated!")
-        update_json(bot.msg_dic)
+
+    @tasks.loop(minutes=1)
+    async def evict(self):
+        # keeps the loaded guilds within max_guilds/max_members
+        await evict_guilds(self)
+
+    @tasks.loop(minutes=1)
+    async def sweep_names(self):
+        # refreshes "name_sweep" names a minute from the member cache, for the
+        # users whose updates were missed
+        amount = self.settings.get("name_sweep")
+        if amount:
+            self.renames.sweep(self.guilds, amount)
 
     @tasks.loop(hours=24)
     async def save(self):
-        # create/update json for every server every 24 hours
-        saver()
+        # backs up every server that changed in the last 24 hours
+        await self.backups.run()
+        print("Backup done!")
 
     @json_updater.before_loop
     async def before_update(self):
@@ -58,45 +159,105 @@ class MsgLeaderBot(commands.Bot):
     async def before_save(self):
         await bot.wait_until_ready()
 
+    @evict.before_loop
+    async def before_evict(self):
+        await bot.wait_until_ready()
+
+    @sweep_names.before_loop
+    async def before_sweep(self):
+        await bot.wait_until_ready()
+
+
+shard_ids, shard_count, group = config()
+bot = MsgLeaderBot(shard_ids, shard_count, group)
+
+# reactions used to flip through the pages of the leaderboard
+PAGE_EMOJIS = {"◀️": -1, "▶️": 1}
+
+owns = None if shard_ids is None else Ownership(shard_ids, shard_count)
+bot.storage = open_storage(owns)
+bot.settings = Settings(bot.storage)
+
+if owns is not None and not isinstance(bot.storage, SQLiteStorage):
+    # the processes would overwrite each other's messages.json
+    sys.exit("running sharded needs the database, run python storage.py first")
+
+if not bot.settings.token:
+    bot.settings.token = input("input bot token: ")
+
+bot.msg_dic = bot.storage.load()
+bot.backups = Backups(bot.msg_dic)
+bot.ingest = Ingest(bot)
+bot.renames = Renames(bot)
+bot.authors = AuthorIndex()
+if owns is None:
+    bot.windows = Activity()
+else:
+    bot.windows = Activity(f"activity.{group}.json", owns)
+
 
-bot = MsgLeaderBot()
+class Window(commands.Converter):
+    # one of the time windows of the leaderboard
+    async def convert(self, ctx, argument):
+        if argument.lower() not in WINDOWS:
+            raise commands.BadArgument(f"{argument} is not a time window")
+        return argument.lower()
 
-try:
-    with open("settings.json", "r") as a:
-        bot.settings = json.loads(a.read())
-    bot.settings["token"]
-except (FileNotFoundError, KeyError, json.decoder.JSONDecodeError):
-    token = input("input bot token: ")
-    bot.settings = {"token": token}
-    with open("settings.json", "w+") as a:
-        json.dump(bot.settings, a, indent=4)
 
-try:
-    with open("messages.json", "r") as b:
-        bot.msg_dic = json.loads(b.read())
-except (FileNotFoundError, json.decoder.JSONDecodeError):
-    bot.msg_dic = {}
+@bot.before_invoke
+async def start_timer(ctx):
+    ctx.started = time.perf_counter()
+
+
+@bot.after_invoke
+async def stop_timer(ctx):
+    # latency of every command, including the ones that failed
+    name = ctx.command.name
+    metrics.observe("command_seconds", time.perf_counter() - ctx.started, command=name)
+    if ctx.command_failed:
+        metrics.inc("command_errors_total", command=name)
 
 
 @bot.command()
 @commands.has_guild_permissions(manage_channels=True)
 async def autoupdate(ctx):
     """turns on/off automatic addition of new users to the leaderboard"""
-    server = str(ctx.message.guild.id)
+    settings = guild_settings(bot, str(ctx.message.guild.id))
 
-    if bot.settings[server]["listen_to_all"]:
-        bot.settings[server]["listen_to_all"] = False
-        update_settings(bot.settings)
+    if settings.listen_to_all:
+        settings.listen_to_all = False
+        bot.settings.save()
         return await ctx.send(
             "New users **will not** get added to the leaderboard anymore"
         )
 
     else:
-        bot.settings[server]["listen_to_all"] = True
-        update_settings(bot.settings)
+        settings.listen_to_all = True
+        bot.settings.save()
         return await ctx.send("New users **will** get added to the leaderboard")
 
 
+@bot.command()
+@commands.has_guild_permissions(manage_channels=True)
+async def globaloptout(ctx):
+    """turns on/off listing this server's users on the global leaderboard"""
+    server = str(ctx.message.guild.id)
+    settings = guild_settings(bot, server)
+    settings.global_lb = not settings.global_lb
+    bot.settings.save()
+
+    toggle_network(bot, server)
+
+    if settings.global_lb:
+        return await ctx.send(
+            "This server's users **will** be on the global leaderboard"
+        )
+
+    await ctx.send(
+        "This server's users **will not** be on the global leaderboard anymore"
+    )
+
+
 @bot.command()
 @commands.has_guild_permissions(manage_channels=True)
 async def edit(ctx, user: discord.User, message_number: int):
@@ -104,18 +265,12 @@ async def edit(ctx, user: discord.User, message_number: int):
     name = user.name
     server = str(ctx.message.guild.id)
     if str(user.id) not in bot.msg_dic[server]:
-        bot.msg_dic[server][str(user.id)] = {
-            "messages": message_number,
-            "name": name,
-            "alt": None,
-            "is_alt": False,
-            "is_bot": False,
-        }
+        bot.msg_dic[server][str(user.id)] = Member(message_number, name)
 
     else:
         bot.msg_dic[server][str(user.id)]["messages"] = message_number
 
-    update_json(bot.msg_dic)
+    refresh_user(bot, server, str(user.id))
     await ctx.send(f"{name} was saved with {message_number} messages")
 
 
@@ -153,7 +308,7 @@ async def addbot(ctx, user: discord.User):
             await ctx.send(f"{user} is already a bot")
         else:
             bot.msg_dic[server][str(user.id)]["is_bot"] = True
-            update_json(bot.msg_dic)
+            refresh_user(bot, server, str(user.id))
             await ctx.send(f"{user} is now a bot")
     except KeyError:
         await ctx.send(f"Error: {user} is not listed in the leaderboard")
@@ -170,7 +325,7 @@ async def rmvbot(ctx, user: discord.User):
             await ctx.send(f"{user} is already not a bot")
         else:
             bot.msg_dic[server][str(user.id)]["is_bot"] = False
-            update_json(bot.msg_dic)
+            refresh_user(bot, server, str(user.id))
             await ctx.send(f"{user} is no longer a bot")
     except KeyError:
         await ctx.send(f"Error: {user} is not listed in the leaderboard")
@@ -183,7 +338,7 @@ async def delete(ctx, user: discord.User):
     server = str(ctx.message.guild.id)
     try:
         bot.msg_dic[server].pop(str(user.id))
-        update_json(bot.msg_dic)
+        refresh_user(bot, server, str(user.id))
         await ctx.send(f"{user} was deleted")
     except KeyError:
         await ctx.send(f"Error: {user} is not listed in the leaderboard")
@@ -193,9 +348,8 @@ async def delete(ctx, user: discord.User):
 @commands.has_guild_permissions(manage_channels=True)
 async def minimum(ctx, value: int):
     """change the minimum amount of messages necessary to appear on the leaderboard (defaults to 20000)"""
-    server = str(ctx.message.guild.id)
-    bot.settings[server]["minimum"] = value
-    update_settings(bot.settings)
+    guild_settings(bot, str(ctx.message.guild.id)).minimum = value
+    bot.settings.save()
 
     if value == 1:
         await ctx.send(
@@ -216,6 +370,211 @@ async def minimum_err(ctx, error):
     await on_command_error(ctx, error, bypass_check=True)
 
 
+@bot.command()
+@commands.has_guild_permissions(manage_channels=True)
+async def restore(ctx, backup: int = 1):
+    """restores the leaderboard from a backup (1 is the most recent one)"""
+    server = str(ctx.message.guild.id)
+    history = bot.backups.history(server)
+
+    if not 1 <= backup <= len(history):
+        return await ctx.send(
+            f"Error: there are only {len(history)} backups of this server"
+        )
+
+    replace_guild(bot, server, bot.backups.restore(server, backup - 1))
+    await ctx.send(f"Leaderboard restored from backup {backup}")
+
+
+@restore.error
+async def restore_err(ctx, error):
+    # error handler for restore command
+    if isinstance(error, commands.BadArgument):
+        return await ctx.send("Error: invalid backup number")
+
+    await on_command_error(ctx, error, bypass_check=True)
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_channels=True)
+async def backfill(ctx):
+    """counts the messages sent before the bot joined (an interrupted scan is resumed)"""
+    server = str(ctx.message.guild.id)
+
+    if server in bot.backfills:
+        return await ctx.send("Error: this server is already being scanned")
+
+    if guild_settings(bot, server).backfilled:
+        return await ctx.send("Error: this server's history was already counted")
+
+    channels = ctx.guild.text_channels
+    # messages sent since the bot joined were counted by on_message
+    before = ctx.guild.me.joined_at or datetime.datetime.utcnow()
+    job = bot.backfills[server] = Backfill(bot, server, before)
+    await ctx.send(f"Scanning {len(channels)} channels...")
+
+    try:
+        users = await job.run(channels)
+    finally:
+        bot.backfills.pop(server)
+
+    messages = sum(job.state["counts"].values())
+    await ctx.send(f"Backfill done: {messages} messages counted for {users} users")
+
+
+@bot.command(name="import")
+@commands.has_guild_permissions(manage_channels=True)
+async def import_users(ctx):
+    """replaces the users listed in the attached CSV or JSON file (id, messages, name, alts, is_bot)"""
+    server = str(ctx.message.guild.id)
+
+    if not ctx.message.attachments:
+        return await ctx.send("Error: you must attach a .csv or .json file")
+
+    attachment = ctx.message.attachments[0]
+    users, errors = parse(await attachment.read(), attachment.filename)
+
+    if not errors:
+        bot.ingest.apply(server)
+        msg_dic = bot.msg_dic[server]
+        guild, errors = merge(msg_dic, users)
+
+    if errors:
+        result = "\n".join(errors[:MAX_ERRORS])
+        if len(errors) > MAX_ERRORS:
+            result += f"\n...and {len(errors) - MAX_ERRORS} more"
+        return await ctx.send(
+            discord.utils.escape_mentions(
+                f"Error: nothing was imported\n```\n{result}\n```"
+            )
+        )
+
+    # users that became (or stopped being) alts get saved too
+    changed = set(users) | {
+        id for id in guild if id in msg_dic and guild[id] is not msg_dic[id]
+    }
+    replace_guild(bot, server, guild, changed)
+    await ctx.send(f"{len(users)} users imported")
+
+
+@bot.command(name="export")
+@commands.has_guild_permissions(manage_channels=True)
+async def export_users(ctx, format: str = "csv"):
+    """sends the leaderboard's data as a CSV (default) or JSON file"""
+    server = str(ctx.message.guild.id)
+    format = format.lower()
+
+    if format not in ("csv", "json"):
+        return await ctx.send("Error: the format must be csv or json")
+
+    bot.ingest.apply(server)
+    with tempfile.TemporaryFile() as f:
+        await export(bot.msg_dic[server], f, format)
+        await ctx.send(file=discord.File(f, filename=f"leaderboard-{server}.{format}"))
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_channels=True)
+async def stats(ctx):
+    """prints where the bot spends its time"""
+    server = str(ctx.message.guild.id)
+    uptime = int(time.time() - metrics.started)
+    result = [
+        f"Uptime: {uptime // 3600}h {uptime % 3600 // 60}m",
+        f"Messages: {bot.ingest.rate(server):.1f}/s here, "
+        f"{bot.ingest.rate():.1f}/s in every server "
+        f"({metrics.counter('messages_total', guild=server)} here since start)",
+        "",
+        "Command       p50      p95    count",
+    ]
+
+    latencies = [
+        (dict(labels)["command"], histogram)
+        for labels, histogram in metrics.labelled("command_seconds").items()
+    ]
+    event = metrics.histogram("event_seconds", event="on_message")
+    if event is not None:
+        latencies.append(("on_message", event))
+
+    # histograms only know the bucket a value fell in, so these are upper bounds
+    for name, histogram in sorted(latencies, key=lambda item: -item[1].count):
+        result.append(
+            f"{name:<12} {_ms(histogram.quantile(0.5)):>6} "
+            f"{_ms(histogram.quantile(0.95)):>8} {histogram.count:>8}"
+        )
+
+    result.append("")
+    for labels, histogram in sorted(metrics.labelled("flush_seconds").items()):
+        result.append(
+            f"Saves ({dict(labels)['storage']}): {histogram.count}, "
+            f"{_ms(histogram.sum / histogram.count)} on average"
+        )
+
+    for name, label in (
+        ("backup_seconds", "Backups"),
+        ("settings_save_seconds", "Settings saves"),
+    ):
+        histogram = metrics.histogram(name)
+        if histogram is not None:
+            result.append(
+                f"{label}: {histogram.count}, {_ms(histogram.sum / histogram.count)} on average"
+            )
+
+    cache = {
+        result: metrics.counter("guild_cache_total", result=result)
+        for result in ("hit", "miss", "eviction")
+    }
+    result.append(
+        f"Servers loaded: {len(bot.msg_dic)} ({cache['hit']} hits, "
+        f"{cache['miss']} misses, {cache['eviction']} evictions)"
+    )
+
+    for (name, labels), amount in sorted(metrics.counters.items()):
+        if name == "bytes_written_total":
+            result.append(f"Written to {dict(labels)['file']}: {amount / 1024:.1f} KiB")
+        elif name == "rows_written_total":
+            result.append(f"Rows written to the database: {amount}")
+        elif name == "renames_total":
+            result.append(f"Names updated: {amount}")
+        elif name == "loop_stalls_total":
+            result.append(f"Event loop stalls: {amount} (see stalls.log)")
+
+    await ctx.send("```\n" + "\n".join(result) + "\n```")
+
+
+@bot.command()
+@commands.has_guild_permissions(manage_channels=True)
+async def profile(ctx, action: str = ""):
+    """starts or stops sampling where the bot spends its time (flamegraph input)"""
+    if action == "start":
+        if bot.profiler.running:
+            return await ctx.send("Error: the profiler is already running")
+
+        bot.profiler.start()
+        await ctx.send("Profiling, use -profile stop to get the results")
+
+    elif action == "stop":
+        if not bot.profiler.running:
+            return await ctx.send("Error: the profiler isn't running")
+
+        seconds = time.time() - bot.profiler.started
+        collapsed = bot.profiler.stop()
+        await ctx.send(
+            f"{sum(bot.profiler.samples.values())} samples in {seconds:.0f}s",
+            file=discord.File(io.BytesIO(collapsed.encode()), filename="profile.txt"),
+        )
+
+    else:
+        await ctx.send("Error: use -profile start or -profile stop")
+
+
+def _ms(seconds):
+    # histogram bounds and averages in a readable unit
+    if seconds == float("inf"):
+        return "slow"
+    return f"{seconds * 1000:.1f}ms"
+
+
 @bot.command()
 async def source(ctx):
     """prints the source code link"""
@@ -225,15 +584,16 @@ async def source(ctx):
 @bot.command()
 async def ping(ctx):
     """Tells the ping of the bot to the discord servers"""
-    update_json(bot.msg_dic)  # because why not
-    await ctx.send(f"Pong! {round(bot.latency*1000)}ms")
+    await ctx.send(
+        f"Pong! {round(bot.latency*1000)}ms ({bot.ingest.rate():.1f} messages/s)"
+    )
 
 
 @bot.command()
 async def minfo(ctx):
     """prints the current minimum value to appear on the leaderboard"""
     await ctx.send(
-        f"The current minimum is {bot.settings[str(ctx.message.guild.id)]['minimum']} messages"
+        f"The current minimum is {guild_settings(bot, str(ctx.message.guild.id)).minimum} messages"
     )
 
 
@@ -253,107 +613,235 @@ async def name(ctx):
 
     else:
         msg_dic[str(author.id)]["name"] = name
+        get_names(bot, str(ctx.message.guild.id)).add(str(author.id))
+        mark_changed(bot, str(ctx.message.guild.id), str(author.id))
         await ctx.send(f"Name updated to {name}")
 
 
 @bot.command()
-async def msglb(ctx):
-    """prints the message leaderboard"""
-    update_json(bot.msg_dic)
+async def msglb(ctx, window: typing.Optional[Window] = None, page: int = 1):
+    """prints the message leaderboard (of all time, or of the last day/week/month)"""
     server = str(ctx.message.guild.id)
     author = str(ctx.author.id)
-    smgs_dic = {}
-    msg_lb = ""
-    bots_lb = ""
-    top_users = []
     msg_dic = bot.msg_dic[server]
 
     if author in msg_dic and msg_dic[author]["is_alt"]:
-        for id in msg_dic:
-            if msg_dic[id]["alt"] is not None and author in msg_dic[id]["alt"]:
-                author = id
-                break
+        author = get_alts(bot, server).owner(author)
 
-    for id in msg_dic:
-        # excludes alt users from the leadeboard
-        if not msg_dic[id]["is_alt"]:
-            if not msg_dic[id]["alt"]:
-                smgs_dic[id] = msg_dic[id]["messages"]
+    def render(page):
+        if window is None:
+            board = get_board(bot, server)
+            title = "Message Leaderboard"
+        else:
+            board = get_window_board(bot, server, window)
+            title = f"Message Leaderboard (last {window})"
+        page = min(max(page, 1), board.pages)
+
+        embed = discord.Embed(
+            title=title,
+            color=7419530,
+            description=board.show(author, page - 1),
+        )
+        footer = f"Page {page}/{board.pages}"
+        if author in board.ranking.users:
+            footer += f" • you are #{board.ranking.users.rank(author)}"
+        embed.set_footer(text=footer)
+
+        return page, board.pages, embed
+
+    if (
+        window is None
+        and page <= 1
+        and server not in bot.ranks
+        and isinstance(bot.storage, SQLiteStorage)
+    ):
+        # the first page comes from the database's index, the ranking is only
+        # built if the requester flips to another page
+        page, pages, embed = await first_page(server, author)
+    else:
+        page, pages, embed = render(page)
+    message = await ctx.send(embed=embed)
 
-            # sums the number of messages of users with alts to its respective alts
-            if msg_dic[id]["alt"]:
-                messages = 0
+    if pages > 1:
+        # the requester can flip through the pages for a minute
+        asyncio.ensure_future(flip_pages(ctx, message, page, render))
 
-                for alt in msg_dic[id]["alt"]:
-                    messages += msg_dic[alt]["messages"]
 
-                smgs_dic[id] = msg_dic[id]["messages"] + messages
+async def first_page(server, author):
+    # the first page of the leaderboard, read from the database
+    storage = bot.storage
+    msg_dic = bot.msg_dic[server]
+    minimum = guild_settings(bot, server).minimum
+    await storage.flush()
+
+    count = storage.count(server, minimum)
+    bots = storage.count(server, minimum, bots=True)
+    users = storage.top(server, minimum, PAGE)
+    shown = (
+        storage.top(server, minimum, PAGE - count, bots=True) if count < PAGE else []
+    )
+    found = storage.rank(server, author) if author is not None else None
 
-    # sorts the leaderboard
-    smgs_dic = dict(sorted(smgs_dic.items(), key=lambda item: item[1], reverse=True))
+    # like Board.show, bots are only added at the end when below the minimum
+    messages = None
+    is_bot = found is not None and msg_dic[author]["is_bot"]
+    if found is not None and (not is_bot or found[1] < minimum):
+        messages = found[1]
 
-    # restricts the leaderboard to only users with more than a certain minimum
-    for user in smgs_dic:
-        if int(smgs_dic[user]) >= bot.settings[server]["minimum"]:
-            top_users.append(user)
+    pages = max(-(-(count + bots) // PAGE), 1)
+    embed = discord.Embed(
+        title="Message Leaderboard",
+        color=7419530,
+        description=top_page(msg_dic, users, shown, author, messages),
+    )
+    footer = f"Page 1/{pages}"
+    if found is not None and not is_bot:
+        footer += f" • you are #{found[0]}"
+    embed.set_footer(text=footer)
 
-            # prevents bots from being on the top
-            if msg_dic[user]["is_bot"]:
-                bots_lb += f"{smgs_dic[user]}: {msg_dic[user]['name']}\n"
+    return 1, pages, embed
 
-            elif msg_dic[user]["alt"] is not None:
-                if author == user:
-                    msg_lb += "**"
 
-                if len(msg_dic[user]["alt"]) == 1:
-                    msg_lb += f"{smgs_dic[user]}: {msg_dic[user]['name']} + alt\n"
+@msglb.error
+async def msglb_err(ctx, error):
+    # error handler for msglb command
+    if isinstance(error, commands.BadArgument):
+        return await ctx.send("Error: invalid time window or page")
 
-                else:
-                    alts = len(msg_dic[user]["alt"])
-                    msg_lb += (
-                        f"{smgs_dic[user]}: {msg_dic[user]['name']} +{alts} alts\n"
-                    )
+    await on_command_error(ctx, error, bypass_check=True)
 
-                if author == user:
-                    msg_lb += "**"
 
-            else:
-                if author == user:
-                    msg_lb += "**"
+@bot.command()
+async def globallb(ctx, page: int = 1):
+    """prints the message leaderboard of every server the bot is in"""
+    author = str(ctx.author.id)
+    network = await get_network(bot)
 
-                msg_lb += f"{smgs_dic[user]}: {msg_dic[user]['name']}\n"
+    def render(page):
+        board = get_network_board(bot, network)
+        page = min(max(page, 1), board.pages)
 
-                if author == user:
-                    msg_lb += "**"
+        embed = discord.Embed(
+            title="Global Message Leaderboard",
+            color=7419530,
+            description=board.show(author, page - 1),
+        )
+        footer = f"Page {page}/{board.pages}"
+        if author in network.users:
+            footer += f" • you are #{network.users.rank(author)}"
+        embed.set_footer(text=footer)
 
-    # adds bots to the end
-    msg_lb += "\n" + bots_lb
+        return page, board.pages, embed
 
-    # adds message author to the end if not already on the leaderboard
-    if author in msg_dic and author not in top_users:
-        if msg_dic[author]["alt"]:
-            if len(msg_dic[author]["alt"]) == 1:
-                msg_lb += f"**{smgs_dic[author]}: {msg_dic[author]['name']} + alt**"
+    page, pages, embed = render(page)
+    message = await ctx.send(embed=embed)
 
-            else:
-                alts = len(msg_dic[author]["alt"])
-                msg_lb += (
-                    f"**{smgs_dic[author]}: {msg_dic[author]['name']} +{alts} alts**"
-                )
+    if pages > 1:
+        asyncio.ensure_future(flip_pages(ctx, message, page, render))
 
-        else:
-            msg_lb += f"**{smgs_dic[author]}: {msg_dic[author]['name']}**"
 
-    embed = discord.Embed(
-        title="Message Leaderboard", color=7419530, description=msg_lb
-    )
-    await ctx.send(embed=embed)
+@globallb.error
+async def globallb_err(ctx, error):
+    if isinstance(error, commands.BadArgument):
+        return await ctx.send("Error: invalid page")
+
+    await on_command_error(ctx, error, bypass_check=True)
+
+
+async def flip_pages(ctx, message, page, render):
+    # turns the pages of a message when its author reacts with the arrows
+    try:
+        for emoji in PAGE_EMOJIS:
+            await message.add_reaction(emoji)
+    except discord.errors.Forbidden:
+        # without the add reactions permission, the other pages can still be
+        # asked for with the page number
+        return
+
+    def check(reaction, user):
+        return (
+            reaction.message.id == message.id
+            and user == ctx.author
+            and str(reaction.emoji) in PAGE_EMOJIS
+        )
+
+    while True:
+        try:
+            reaction, user = await bot.wait_for("reaction_add", timeout=60, check=check)
+        except asyncio.TimeoutError:
+            break
+
+        page, _, embed = render(page + PAGE_EMOJIS[str(reaction.emoji)])
+        await message.edit(embed=embed)
+
+        try:
+            await message.remove_reaction(reaction.emoji, user)
+        except discord.errors.Forbidden:
+            pass
+
+    try:
+        await message.clear_reactions()
+    except discord.errors.Forbidden:
+        pass
+
+
+@bot.command()
+async def rank(ctx, user: discord.User = None):
+    """prints a user's position on the leaderboard"""
+    server = str(ctx.message.guild.id)
+    user = str((user or ctx.author).id)
+    msg_dic = bot.msg_dic[server]
+
+    if user in msg_dic and msg_dic[user]["is_alt"]:
+        user = get_alts(bot, server).owner(user)
+
+    if server not in bot.ranks and isinstance(bot.storage, SQLiteStorage):
+        # the database's index answers without building the guild's ranking
+        await bot.storage.flush()
+        found = bot.storage.rank(server, user) if user is not None else None
+    else:
+        found = rank_of(get_ranking(bot, server), user)
+
+    if found is None:
+        return await ctx.send("Error: user is not listed in the leaderboard")
+
+    position, messages, ahead = found
+    result = f"{msg_dic[user]['name']} is #{position} with {messages} messages"
+
+    if ahead is not None:
+        result += f" ({ahead[1] - messages} behind #{ahead[0]})"
+
+    await ctx.send(discord.utils.escape_mentions(result))
+
+
+@bot.command()
+async def msgstats(ctx):
+    """prints how the messages are spread among the users"""
+    server = str(ctx.message.guild.id)
+    minimum = guild_settings(bot, server).minimum
+    stats = get_stats(bot, server)
+
+    if not stats.members:
+        return await ctx.send("Error: nobody is listed in the leaderboard")
+
+    above = get_ranking(bot, server).users.count_at_least(minimum)
+    result = [
+        f"Users: {stats.members} (alts counted with their owner, bots left out)",
+        f"Messages: {stats.total}, {stats.mean:.1f} per user",
+        f"Median: {stats.median:.0f}, 90th percentile: {stats.p90:.0f}, "
+        f"99th percentile: {stats.p99:.0f}",
+        f"Above the minimum ({minimum}): {above} ({above * 100 / stats.members:.1f}%)",
+        f"Top 10% of users: {stats.top_share * 100:.1f}% of the messages",
+        f"Gini coefficient: {stats.gini:.3f} (0 if everyone sent as many messages)",
+    ]
+    await ctx.send("```\n" + "\n".join(result) + "\n```")
 
 
 @bot.command()
 async def msg(ctx, username: str = ""):
     """check how many messages a user has"""
-    msg_dic = bot.msg_dic[str(ctx.message.guild.id)]
+    server = str(ctx.message.guild.id)
+    msg_dic = bot.msg_dic[server]
     success = False
 
     if not username:
@@ -386,17 +874,14 @@ async def msg(ctx, username: str = ""):
 
     # checks if input is a username on the leaderboard
     else:
-        for id in msg_dic:
-            if msg_dic[id]["name"].lower() == username.lower():
-                username = id
-                success = True
-                break
+        id = get_names(bot, server).lookup(username)
 
-        try:
-            msg_dic[username]
-        except KeyError:
+        if id is not None:
+            username = id
+            success = True
+        else:
             await ctx.send(
-                discord.utils.escape_mentions(f"Error: {username} not found")
+                discord.utils.escape_mentions(not_found(bot, server, username))
             )
 
     if success:
@@ -409,10 +894,7 @@ async def msg(ctx, username: str = ""):
             )
 
         else:
-            alt_messages = 0
-
-            for alt in msg_dic[username]["alt"]:
-                alt_messages += msg_dic[alt]["messages"]
+            alt_messages = get_alts(bot, server).total(username) - messages
 
             await ctx.send(
                 discord.utils.escape_mentions(
@@ -424,7 +906,8 @@ async def msg(ctx, username: str = ""):
 @bot.command()
 async def altinfo(ctx, username: str):
     """check the name of a user's alt or vice versa"""
-    msg_dic = bot.msg_dic[str(ctx.message.guild.id)]
+    server = str(ctx.message.guild.id)
+    msg_dic = bot.msg_dic[server]
     result = ""
     success = False
 
@@ -455,26 +938,24 @@ async def altinfo(ctx, username: str):
 
     # checks if input is a username on the leaderboard
     else:
-        for id in msg_dic:
-            if msg_dic[id]["name"].lower() == username.lower():
-                username = id
-                success = True
-                break
+        id = get_names(bot, server).lookup(username)
 
-        try:
-            msg_dic[username]
-        except KeyError:
+        if id is not None:
+            username = id
+            success = True
+        else:
             await ctx.send(
-                discord.utils.escape_mentions(f"Error: {username} not found")
+                discord.utils.escape_mentions(not_found(bot, server, username))
             )
 
     if success:
         # checks if username is an alt and gets its name
         if msg_dic[username]["is_alt"]:
-            for id in msg_dic:
-                if msg_dic[id]["alt"] is not None and username in msg_dic[id]["alt"]:
-                    result = f"{msg_dic[username]['name']} is an alt of {msg_dic[id]['name']}"
-                    break
+            id = get_alts(bot, server).owner(username)
+            if id is not None:
+                result = (
+                    f"{msg_dic[username]['name']} is an alt of {msg_dic[id]['name']}"
+                )
 
         # checks if username has an alt and gets its name
         elif msg_dic[username]["alt"] is not None:
@@ -498,52 +979,83 @@ async def on_message(message):
     if user == bot.user:
         return
 
-    try:
-        msg_dic = bot.msg_dic[str(message.guild.id)]
-    except KeyError:
-        msg_dic = bot.msg_dic[str(message.guild.id)] = {}
+    with metrics.timer("event_seconds", event="on_message"):
+        server = str(message.guild.id)
+        id = str(user.id)
+        bot.msg_dic.touch(server)
+        msg_dic = bot.msg_dic[server]
+        settings = guild_settings(bot, server)
 
-    try:
-        bot.settings[str(message.guild.id)]["minimum"]
-        bot.settings[str(message.guild.id)]["listen_to_all"]
-    except KeyError:
-        bot.settings[str(message.guild.id)] = {"minimum": 20000, "listen_to_all": True}
-        update_settings(bot.settings)
-    settings = bot.settings[str(message.guild.id)]
-
-    # adds a point to the author everytime a message is sent
-    if str(user.id) not in msg_dic and settings["listen_to_all"]:
-        if user.bot:
-            msg_dic[str(user.id)] = {
-                "messages": 1,
-                "name": user.name,
-                "alt": None,
-                "is_alt": False,
-                "is_bot": True,
-            }
-        else:
-            msg_dic[str(user.id)] = {
-                "messages": 1,
-                "name": user.name,
-                "alt": None,
-                "is_alt": False,
-                "is_bot": False,
-            }
+        # adds a point to the author everytime a message is sent
+        if id in msg_dic:
+            bot.ingest.count(server, id)
+
+        elif settings.listen_to_all:
+            msg_dic[id] = Member(1, user.name, is_bot=user.bot)
+            refresh_user(bot, server, id)
+
+        if id in msg_dic:
+            if msg_dic[id]["name"] != user.name:
+                bot.renames.queue(server, id, user.name)
+            bot.windows.count(server, id)
+            # remembers who sent it in case it gets deleted
+            bot.authors.add(message.id, message.guild.id, user.id)
+            metrics.inc("messages_total", guild=server)
+
+    # process a command (only messages starting with the prefix can be one)
+    if message.content.startswith(bot.command_prefix):
+        # commands get to see every message counted so far
+        bot.ingest.apply(server)
+        await bot.process_commands(message)
+
+
+@bot.event
+async def on_user_update(before, after):
+    # a new username, for every guild the user is on
+    if before.name != after.name:
+        bot.renames.queue(None, str(after.id), after.name)
+
+
+@bot.event
+async def on_member_update(before, after):
+    if before.name != after.name:
+        bot.renames.queue(str(after.guild.id), str(after.id), after.name)
 
-    elif str(user.id) in msg_dic:
-        msg_dic[str(user.id)]["messages"] += 1
 
-    # process a command (if valid)
-    await bot.process_commands(message)
+@bot.event
+async def on_raw_message_delete(payload):
+    # fires for every deleted message, not only the ones still in the cache
+    uncount_messages(payload.guild_id, [payload.message_id])
 
 
 @bot.event
-async def on_message_delete(message):
-    user = str(message.author.id)
-    msg_dic = bot.msg_dic[str(message.guild.id)]
+async def on_raw_bulk_message_delete(payload):
+    uncount_messages(payload.guild_id, payload.message_ids)
+
+
+def uncount_messages(guild, messages):
+    # takes deleted messages off their authors, without asking discord who
+    # sent them, with one update per author
+    if guild is None:
+        return
+
+    server = str(guild)
+    msg_dic = bot.msg_dic[server]
+    amounts = {}
+
+    for message in messages:
+        sent = bot.authors.pop(message)
+        if sent is None:
+            continue
+
+        user = str(sent[1])
+        if user in msg_dic:
+            amounts[user] = amounts.get(user, 0) + 1
+            # only the window the message was sent in loses it
+            bot.windows.count(server, user, -1, snowflake_time(message))
 
-    if user in msg_dic:
-        msg_dic[user]["messages"] -= 1
+    for user, amount in amounts.items():
+        bot.ingest.count(server, user, -amount)
 
 
 @bot.event
@@ -582,4 +1094,4 @@ async def on_command_error(
 
 
 if __name__ == "__main__":
-    bot.run(bot.settings["token"])
+    bot.run(bot.settings.token)
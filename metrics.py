@@ -0,0 +1,178 @@
+import asyncio
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
+# upper bounds (in seconds) of the buckets of every latency histogram
+BUCKETS = (
+    0.0001,
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+)
+
+PREFIX = "msgleaderbot_"
+
+# port of the prometheus endpoint, can be changed with "metrics_port" in the
+# settings (null turns it off)
+PORT = 9108
+
+
+class Histogram:
+    # counts of the observed values per bucket, the last one has everything
+    # above the highest bound
+
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q):
+        # upper bound of the bucket the q-th value falls in
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= q * self.count:
+                return bound
+
+        return float("inf")
+
+
+class Metrics:
+    # latency histograms and counters of the whole bot, labelled like
+    # prometheus metrics: {(name, ((label, value), ...)): metric}
+
+    def __init__(self):
+        self.histograms = {}
+        self.counters = {}
+        self.started = time.time()
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        try:
+            histogram = self.histograms[key]
+        except KeyError:
+            histogram = self.histograms[key] = Histogram()
+
+        histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, name, **labels):
+        # observes how long the block took, even if it raised
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def histogram(self, name, **labels):
+        return self.histograms.get((name, tuple(sorted(labels.items()))))
+
+    def counter(self, name, **labels):
+        return self.counters.get((name, tuple(sorted(labels.items()))), 0)
+
+    def labelled(self, name):
+        # {labels: histogram} of every histogram called `name`
+        return {
+            labels: histogram
+            for (metric, labels), histogram in self.histograms.items()
+            if metric == name
+        }
+
+    def exposition(self):
+        # every metric in the prometheus text format
+        lines = []
+        typed = set()
+
+        for (name, labels), value in sorted(self.counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} counter")
+            lines.append(f"{PREFIX}{name}{_labels(labels)} {value}")
+
+        for (name, labels), histogram in sorted(
+            self.histograms.items(), key=lambda item: item[0]
+        ):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {PREFIX}{name} histogram")
+
+            seen = 0
+            for bound, count in zip(BUCKETS + ("+Inf",), histogram.counts):
+                seen += count
+                bucket = _labels(labels + (("le", bound),))
+                lines.append(f"{PREFIX}{name}_bucket{bucket} {seen}")
+            lines.append(f"{PREFIX}{name}_sum{_labels(labels)} {histogram.sum}")
+            lines.append(f"{PREFIX}{name}_count{_labels(labels)} {histogram.count}")
+
+        lines.append(f"# TYPE {PREFIX}uptime_seconds gauge")
+        lines.append(f"{PREFIX}uptime_seconds {time.time() - self.started}")
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host="127.0.0.1", port=PORT):
+        # minimal http server answering every GET /metrics with exposition()
+        return await asyncio.start_server(self._handle, host, port)
+
+    async def _handle(self, reader, writer):
+        try:
+            request = await reader.readline()
+            # the headers aren't needed
+            while (await reader.readline()).strip():
+                pass
+
+            parts = request.decode("latin-1").split()
+            if len(parts) >= 2 and parts[0] == "GET" and parts[1] == "/metrics":
+                status = "200 OK"
+                body = self.exposition().encode()
+            else:
+                status = "404 Not Found"
+                body = b"not found\n"
+
+            writer.write(
+                f"HTTP/1.1 {status}\r\n"
+                "Content-Type: text/plain; version=0.0.4\r\n"
+                f"Content-Length: {len(body)}\r\n"
+                "Connection: close\r\n\r\n".encode() + body
+            )
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+
+    escaped = (
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"'))
+        for key, value in labels
+    )
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+# every part of the bot records into this one
+metrics = Metrics()
@@ -0,0 +1,105 @@
+from bisect import bisect_left, insort
+from difflib import SequenceMatcher
+
+# how many neighbouring names are compared when looking for typos
+NEIGHBOURS = 25
+
+
+class NameIndex:
+    # case-insensitive name index of a single guild: a dict for exact hits and
+    # two sorted lists (names and reversed names) for prefix and typo lookups
+
+    def __init__(self, msg_dic):
+        self.msg_dic = msg_dic
+        self.names = {}  # id -> casefolded name
+        self.ids = {}  # casefolded name -> ids with that name
+
+        for id in msg_dic:
+            name = msg_dic[id]["name"].casefold()
+            self.names[id] = name
+            self.ids.setdefault(name, []).append(id)
+
+        self.sorted = sorted(self.ids)
+        self.reversed = sorted(name[::-1] for name in self.ids)
+
+    def add(self, id):
+        # indexes a new user or a user whose name changed
+        name = self.msg_dic[id]["name"].casefold()
+        if self.names.get(id) == name:
+            return
+
+        self.discard(id)
+        self.names[id] = name
+
+        if name in self.ids:
+            self.ids[name].append(id)
+        else:
+            self.ids[name] = [id]
+            insort(self.sorted, name)
+            insort(self.reversed, name[::-1])
+
+    def discard(self, id):
+        name = self.names.pop(id, None)
+        if name is None:
+            return
+
+        ids = self.ids[name]
+        ids.remove(id)
+
+        if not ids:
+            del self.ids[name]
+            del self.sorted[bisect_left(self.sorted, name)]
+            del self.reversed[bisect_left(self.reversed, name[::-1])]
+
+    def find(self, name):
+        # returns the id of the user with that exact name (ignoring case)
+        ids = self.ids.get(name.casefold())
+        return ids[0] if ids else None
+
+    def prefixed(self, prefix, limit=5):
+        # returns the ids of up to `limit` users whose name starts with prefix
+        prefix = prefix.casefold()
+        result = []
+
+        for name in self.sorted[bisect_left(self.sorted, prefix) :]:
+            if not name.startswith(prefix) or len(result) >= limit:
+                break
+            result += self.ids[name][: limit - len(result)]
+
+        return result
+
+    def lookup(self, name):
+        # exact match first, then a prefix that only matches one user
+        id = self.find(name)
+        if id is not None:
+            return id
+
+        matches = self.prefixed(name, 2)
+        if len(matches) == 1:
+            return matches[0]
+
+    def suggest(self, name, limit=3):
+        # "did you mean" candidates, only the names around the input in both
+        # sorted lists are compared so typos at either end can be found
+        name = name.casefold()
+        candidates = set()
+
+        for names, key, flip in (
+            (self.sorted, name, False),
+            (self.reversed, name[::-1], True),
+        ):
+            i = bisect_left(names, key)
+            for candidate in names[max(i - NEIGHBOURS, 0) : i + NEIGHBOURS]:
+                candidates.add(candidate[::-1] if flip else candidate)
+
+        scored = []
+        matcher = SequenceMatcher(b=name)
+        for candidate in candidates:
+            matcher.set_seq1(candidate)
+            if matcher.real_quick_ratio() >= 0.6 and matcher.quick_ratio() >= 0.6:
+                ratio = matcher.ratio()
+                if ratio >= 0.6:
+                    scored.append((ratio, candidate))
+
+        scored.sort(reverse=True)
+        return [self.ids[candidate][0] for _, candidate in scored[:limit]]
@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+import uuid
+
+from metrics import metrics
+from utils import FILENAME
+
+# seconds to wait for more changes before writing them
+DELAY = 5
+
+
+def snapshot_guild(msg_dic):
+    # copy of a guild that won't change while it's being serialized
+    return {id: user.to_dict() for id, user in msg_dic.items()}
+
+
+class Persistence:
+    # write-behind saving of messages.json: commands only mark their guild as
+    # dirty and a debounced flush serializes the dirty guilds in a worker
+    # thread, reusing the last serialization of every guild that didn't change
+
+    def __init__(self, msg_dic, filename=FILENAME, delay=DELAY, journal=None):
+        self.msg_dic = msg_dic
+        self.journal = journal
+        self.filename = filename
+        self.delay = delay
+        self.dirty = set(msg_dic)
+        self.fragments = {}  # guild -> json of its last flushed state
+        self.flushes = 0
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def mark(self, server, *ids, debounce=True):
+        # flags a guild (and the users that changed in it) as changed, counters
+        # skip the debounce and get written together with the next flush.
+        # with a journal the users are durable once it's written, so the
+        # snapshot is left to the periodic save and to shutdown
+        self.dirty.add(server)
+
+        if self.journal is not None and ids:
+            for id in ids:
+                self.journal.touch(server, id)
+            return
+
+        if debounce and (self._task is None or self._task.done()):
+            self._task = asyncio.ensure_future(self._debounced())
+
+    async def _debounced(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        async with self._lock:
+            if not self.dirty and self.fragments.keys() == self.msg_dic.keys():
+                return
+
+            # everything journaled so far will be part of this snapshot
+            if self.journal is not None:
+                segment = await self.journal.rotate()
+
+            order = list(self.msg_dic)
+            # guilds that were never written are included too
+            dirty = self.dirty | (set(order) - self.fragments.keys())
+            self.dirty = set()
+            snapshot = {
+                server: snapshot_guild(self.msg_dic[server])
+                for server in dirty
+                if server in self.msg_dic
+            }
+
+            try:
+                with metrics.timer("flush_seconds", storage="json"):
+                    written = await asyncio.get_event_loop().run_in_executor(
+                        None, self._write, snapshot, order
+                    )
+            except Exception:
+                # tries again on the next flush
+                self.dirty |= dirty
+                raise
+
+            self.flushes += 1
+            metrics.inc("bytes_written_total", written, file="messages.json")
+            if self.journal is not None:
+                self.journal.compact(segment)
+
+    def _write(self, snapshot, order):
+        fragments = dict(self.fragments)
+        for server, guild in snapshot.items():
+            fragments[server] = json.dumps(guild, indent=4).replace("\n", "\n    ")
+
+        # same layout json.dump(msg_dic, indent=4) would produce
+        body = ",\n".join(
+            f"    {json.dumps(server)}: {fragments[server]}" for server in order
+        )
+        data = "{\n" + body + "\n}" if body else "{}"
+        temp = f"{uuid.uuid4()}-{self.filename}.tmp"
+        with open(temp, "w") as f:
+            f.write(data)
+
+        os.replace(temp, self.filename)
+        self.fragments = {server: fragments[server] for server in order}
+        return len(data)
@@ -0,0 +1,133 @@
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import Counter
+
+from metrics import metrics
+
+# where the stacks of the stalls are appended
+STALLS = "stalls.log"
+
+# seconds between two samples of the profiler (100 per second)
+SAMPLE_INTERVAL = 0.01
+
+
+def loop_frame(thread):
+    # current frame of the thread running the event loop
+    return sys._current_frames().get(thread)
+
+
+class Watchdog:
+    # the event loop updates a timestamp a few times per threshold and a
+    # thread checks that it keeps doing so. when it doesn't, something is
+    # blocking the loop (and the heartbeats to discord), so the stack the loop
+    # is stuck on gets written to stalls.log while it's still stuck
+
+    def __init__(self, threshold, filename=STALLS):
+        self.threshold = threshold
+        self.filename = filename
+        self.last = time.monotonic()
+        self._loop = None
+        self._thread = None
+        self._task = None
+        self._stop = threading.Event()
+
+    def start(self):
+        # has to be called from the event loop
+        self._loop = asyncio.get_event_loop()
+        self._thread = threading.get_ident()
+        self._task = asyncio.ensure_future(self._beat())
+        threading.Thread(target=self._watch, name="watchdog", daemon=True).start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    async def _beat(self):
+        while True:
+            self.last = time.monotonic()
+            await asyncio.sleep(self.threshold / 4)
+
+    def _watch(self):
+        stalled = None  # timestamp the loop was stuck on, once reported
+
+        while not self._stop.wait(self.threshold / 4):
+            last = self.last
+
+            if stalled is not None and last != stalled:
+                # the loop is back, the beat was due a quarter threshold later
+                seconds = last - stalled - self.threshold / 4
+                self._loop.call_soon_threadsafe(
+                    metrics.observe, "loop_stall_seconds", seconds
+                )
+                stalled = None
+
+            late = time.monotonic() - last
+            if stalled is None and late >= self.threshold:
+                stalled = last
+                self._report(late)
+
+    def _report(self, late):
+        frame = loop_frame(self._thread)
+        stack = "".join(traceback.format_stack(frame)) if frame else "(unknown)\n"
+        with open(self.filename, "a") as f:
+            f.write(
+                f"{time.strftime('%Y-%m-%d %H:%M:%S')} event loop blocked for "
+                f"{late:.2f}s at:\n{stack}\n"
+            )
+
+        print(f"Event loop blocked for {late:.2f}s, stack saved to {self.filename}")
+        self._loop.call_soon_threadsafe(metrics.inc, "loop_stalls_total")
+
+
+class Profiler:
+    # samples the stack of the event loop's thread from another thread and
+    # counts them in the collapsed format of flamegraph.pl (root;...;leaf count)
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.samples = Counter()
+        self.started = None
+        self._thread = None
+        self._worker = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self.started is not None
+
+    def start(self):
+        # has to be called from the event loop
+        self.samples.clear()
+        self.started = time.time()
+        self._stop.clear()
+        self._thread = threading.get_ident()
+        self._worker = threading.Thread(
+            target=self._sample, name="profiler", daemon=True
+        )
+        self._worker.start()
+
+    def stop(self):
+        # returns the samples taken in collapsed form
+        self._stop.set()
+        self._worker.join()
+        self.started = None
+        return "".join(
+            f"{stack} {count}\n" for stack, count in self.samples.most_common()
+        )
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = loop_frame(self._thread)
+            frames = []
+            while frame is not None:
+                code = frame.f_code
+                frames.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+
+            if frames:
+                self.samples[";".join(reversed(frames))] += 1
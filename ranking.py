@@ -0,0 +1,376 @@
+import heapq
+from bisect import bisect_left, insort
+
+# maximum size of a block before it gets split in two
+LOAD = 1000
+# users sorted at once when the global ranking is built in a worker thread
+CHUNK = 20000
+
+
+class RankIndex:
+    # order-statistic list of users sorted by message count (highest first)
+    # keys are (-messages, id) tuples kept in sorted blocks, with a fenwick
+    # tree over the block lengths so positions can be found in O(log n)
+
+    def __init__(self):
+        self._totals = {}
+        self._blocks = []
+        self._maxes = []
+        self._tree = []
+        # bumped on every change, for whatever is computed from all the totals
+        self.version = 0
+
+    @classmethod
+    def from_totals(cls, totals, chunk=None):
+        # builds the index from {id: messages} with a single sort instead of
+        # one insertion per user. with `chunk`, slices of that many users are
+        # sorted and merged, so a worker thread building it never holds the
+        # GIL for a whole sort
+        index = cls()
+        index._totals = totals = dict(totals)
+        if chunk is None:
+            keys = cls._sorted_keys(totals, list(totals))
+        else:
+            ids = list(totals)
+            keys = list(
+                heapq.merge(
+                    *(
+                        cls._sorted_keys(totals, ids[i : i + chunk])
+                        for i in range(0, len(ids), chunk)
+                    )
+                )
+            )
+        index._blocks = [keys[i : i + LOAD] for i in range(0, len(keys), LOAD)]
+        index._maxes = [block[-1] for block in index._blocks]
+        index._build_tree()
+        return index
+
+    @staticmethod
+    def _sorted_keys(totals, ids):
+        # two stable sorts on plain keys are cheaper than one on tuples, the
+        # second one is reversed but keeps equal counts in ascending id order
+        ids.sort()
+        ids.sort(key=totals.__getitem__, reverse=True)
+        return [(-totals[id], id) for id in ids]
+
+    def __len__(self):
+        return len(self._totals)
+
+    def __contains__(self, id):
+        return id in self._totals
+
+    def get(self, id, default=None):
+        return self._totals.get(id, default)
+
+    def values(self):
+        # every total, in no particular order
+        return self._totals.values()
+
+    def totals(self):
+        # copy of {id: messages}
+        return dict(self._totals)
+
+    def set(self, id, messages):
+        old = self._totals.get(id)
+        if old == messages:
+            return
+
+        if old is not None:
+            self._remove((-old, id))
+
+        self._totals[id] = messages
+        self._insert((-messages, id))
+        self.version += 1
+
+    def add(self, id, amount):
+        self.set(id, self._totals.get(id, 0) + amount)
+
+    def discard(self, id):
+        old = self._totals.pop(id, None)
+        if old is not None:
+            self._remove((-old, id))
+            self.version += 1
+
+    def rank(self, id):
+        # 1-based position, users with the same amount of messages share a rank
+        return self._position((-self._totals[id], "")) + 1
+
+    def ahead(self, id):
+        # returns the closest (id, messages) with more messages than the user
+        position = self._position((-self._totals[id], ""))
+        if not position:
+            return None
+
+        key = self._at(position - 1)
+        return key[1], -key[0]
+
+    def count_at_least(self, value):
+        # number of users with at least `value` messages
+        return self._position((1 - value, ""))
+
+    def items(self, start=0, stop=None):
+        # yields (id, messages) from the highest to the lowest count
+        if stop is None or stop > len(self):
+            stop = len(self)
+        if start >= stop:
+            return
+
+        block, offset = self._locate(start)
+        remaining = stop - start
+
+        for keys in self._blocks[block:]:
+            for key in keys[offset : offset + remaining]:
+                yield key[1], -key[0]
+                remaining -= 1
+
+            if not remaining:
+                return
+            offset = 0
+
+    def _insert(self, key):
+        if not self._blocks:
+            self._blocks.append([key])
+            self._maxes.append(key)
+            self._build_tree()
+            return
+
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            i -= 1
+            self._blocks[i].append(key)
+            self._maxes[i] = key
+        else:
+            insort(self._blocks[i], key)
+
+        if len(self._blocks[i]) > LOAD * 2:
+            # splits oversized blocks so inserts stay cheap
+            block = self._blocks[i]
+            self._blocks[i : i + 1] = [block[:LOAD], block[LOAD:]]
+            self._maxes[i : i + 1] = [block[LOAD - 1], block[-1]]
+            self._build_tree()
+        else:
+            self._tree_add(i, 1)
+
+    def _remove(self, key):
+        i = bisect_left(self._maxes, key)
+        block = self._blocks[i]
+        del block[bisect_left(block, key)]
+
+        if not block:
+            del self._blocks[i]
+            del self._maxes[i]
+            self._build_tree()
+        else:
+            self._maxes[i] = block[-1]
+            self._tree_add(i, -1)
+
+    def _position(self, key):
+        # index the key has (or would have) in the sorted order
+        i = bisect_left(self._maxes, key)
+        if i == len(self._maxes):
+            return len(self)
+
+        return self._prefix(i) + bisect_left(self._blocks[i], key)
+
+    def _at(self, position):
+        block, offset = self._locate(position)
+        return self._blocks[block][offset]
+
+    def _locate(self, position):
+        # finds (block, offset) of a position by walking down the fenwick tree
+        block = 0
+        step = 1 << (len(self._tree).bit_length() - 1) if self._tree else 0
+
+        while step:
+            i = block + step
+            if i <= len(self._tree) and self._tree[i - 1] <= position:
+                position -= self._tree[i - 1]
+                block = i
+            step >>= 1
+
+        return block, position
+
+    def _prefix(self, block):
+        # sum of the lengths of every block before `block`
+        total = 0
+        while block:
+            total += self._tree[block - 1]
+            block &= block - 1
+        return total
+
+    def _tree_add(self, block, amount):
+        block += 1
+        while block <= len(self._tree):
+            self._tree[block - 1] += amount
+            block += block & -block
+
+    def _build_tree(self):
+        tree = [len(block) for block in self._blocks]
+        for i in range(1, len(tree) + 1):
+            parent = i + (i & -i)
+            if parent <= len(tree):
+                tree[parent - 1] += tree[i - 1]
+        self._tree = tree
+
+
+class Leaderboard:
+    # ranking of a single guild, bots are kept apart from the users so they
+    # can be displayed on the bottom of the leaderboard
+
+    def __init__(self, msg_dic, alts, ids=None):
+        # `ids` limits the ranking to some users (all of them by default)
+        self.msg_dic = msg_dic
+        self.alts = alts
+        users = {}
+        bots = {}
+
+        for id in msg_dic if ids is None else ids:
+            user = msg_dic.get(id)
+            if user is not None and not user["is_alt"]:
+                (bots if user["is_bot"] else users)[id] = alts.total(id)
+
+        self.users = RankIndex.from_totals(users)
+        self.bots = RankIndex.from_totals(bots)
+
+    def __contains__(self, id):
+        return id in self.users or id in self.bots
+
+    def get(self, id, default=None):
+        return self.index(id).get(id, default)
+
+    def index(self, id):
+        # returns the index the user is ranked in
+        return self.bots if id in self.bots else self.users
+
+    def owner(self, id):
+        return self.alts.owner(id)
+
+    def update(self, id):
+        # re-ranks a user after its data changed, alts re-rank their owner
+        if id in self.msg_dic and self.msg_dic[id]["is_alt"]:
+            self.users.discard(id)
+            self.bots.discard(id)
+            id = self.alts.owner(id)
+
+            if id is None:
+                return
+
+        self._rerank(id)
+
+    def _rerank(self, id):
+        user = self.msg_dic.get(id)
+        if user is None or user["is_alt"]:
+            self.users.discard(id)
+            self.bots.discard(id)
+
+        elif user["is_bot"]:
+            self.users.discard(id)
+            self.bots.set(id, self.alts.total(id))
+
+        else:
+            self.bots.discard(id)
+            self.users.set(id, self.alts.total(id))
+
+
+class GlobalRanking:
+    # users ranked by their messages in every guild that takes part. a guild's
+    # share of a user is its ranking's total for them (alts included, bots left
+    # out), so a change only needs the shares of the user it happened to
+
+    def __init__(self):
+        self.users = RankIndex()
+        self.shares = {}  # id -> {server: total}
+        self.guilds = {}  # server -> ids it has a share of
+        self.names = {}
+        self.version = 0
+
+    @classmethod
+    def from_rows(cls, rows, guilds=()):
+        # builds the ranking in one go, meant to run in a worker thread.
+        # `rows` are (server, id, total, name) of the users of some guilds,
+        # `guilds` (server, {id: total}, msg_dic) of guilds with a ranking
+        network = cls()
+        shares = network.shares
+        names = network.names
+        sums = {}
+
+        def add(server, id, total, name):
+            try:
+                shares[id][server] = total
+            except KeyError:
+                shares[id] = {server: total}
+            network.guilds.setdefault(server, set()).add(id)
+            names[id] = name
+            sums[id] = sums.get(id, 0) + total
+
+        for server, id, total, name in rows:
+            add(server, id, total, name)
+
+        for server, totals, msg_dic in guilds:
+            for id, total in totals.items():
+                user = msg_dic.get(id)
+                add(
+                    server,
+                    id,
+                    total,
+                    user["name"] if user is not None else names.get(id),
+                )
+
+        network.users = RankIndex.from_totals(sums, CHUNK)
+        return network
+
+    def set(self, server, id, total, name=None):
+        # updates a guild's share of a user, None if they aren't ranked there
+        shares = self.shares.get(id)
+
+        if total is None:
+            if shares is None or server not in shares:
+                return
+
+            del shares[server]
+            self.guilds[server].discard(id)
+            if not shares:
+                del self.shares[id]
+                del self.names[id]
+                self.users.discard(id)
+                self.version += 1
+                return
+
+        else:
+            if shares is None:
+                shares = self.shares[id] = {}
+            shares[server] = total
+            self.guilds.setdefault(server, set()).add(id)
+            if name is not None:
+                self.names[id] = name
+
+        self.users.set(id, sum(shares.values()))
+        self.version += 1
+
+    @staticmethod
+    def diff(previous, rows):
+        # (server, id, total, name) changes that turn the `previous` rows of
+        # some guilds into `rows`, and the new {(server, id): (total, name)}
+        # of those guilds. only reads, so it can run in a worker thread
+        current = {(server, id): (total, name) for server, id, total, name in rows}
+        changes = [
+            (server, id, total, name)
+            for (server, id), (total, name) in current.items()
+            if previous.get((server, id)) != (total, name)
+        ]
+        changes.extend(
+            (server, id, None, None)
+            for server, id in previous
+            if (server, id) not in current
+        )
+        return changes, current
+
+    def add_guild(self, server, msg_dic, ranking):
+        for id, messages in ranking.users.items():
+            self.set(server, id, messages, msg_dic[id]["name"])
+
+    def drop(self, server):
+        # takes every share of a guild off
+        for id in list(self.guilds.get(server, ())):
+            self.set(server, id, None)
+        self.guilds.pop(server, None)
@@ -0,0 +1,87 @@
+from collections.abc import MutableMapping
+from operator import attrgetter
+
+IS_ALT = 1
+IS_BOT = 2
+
+KEYS = ("messages", "name", "alt", "is_alt", "is_bot")
+
+# key -> getter of the field, so lookups skip the check against KEYS
+GETTERS = {key: attrgetter(key) for key in KEYS}
+
+
+class Member(MutableMapping):
+    # a tracked user, stored in slots with the alt/bot flags packed in one int
+    # but still usable as the {"messages", "name", "alt", "is_alt", "is_bot"}
+    # dict every command expects
+
+    __slots__ = ("messages", "name", "alt", "flags")
+
+    def __init__(self, messages, name, alt=None, is_alt=False, is_bot=False):
+        self.messages = messages
+        self.name = name
+        self.alt = alt
+        self.flags = (IS_ALT if is_alt else 0) | (IS_BOT if is_bot else 0)
+
+    @classmethod
+    def from_dict(cls, user):
+        return cls(
+            user["messages"], user["name"], user["alt"], user["is_alt"], user["is_bot"]
+        )
+
+    @property
+    def is_alt(self):
+        return bool(self.flags & IS_ALT)
+
+    @is_alt.setter
+    def is_alt(self, value):
+        self.flags = self.flags | IS_ALT if value else self.flags & ~IS_ALT
+
+    @property
+    def is_bot(self):
+        return bool(self.flags & IS_BOT)
+
+    @is_bot.setter
+    def is_bot(self, value):
+        self.flags = self.flags | IS_BOT if value else self.flags & ~IS_BOT
+
+    def __getitem__(self, key):
+        try:
+            return GETTERS[key](self)
+        except KeyError:
+            raise KeyError(key) from None
+
+    def __setitem__(self, key, value):
+        if key not in KEYS:
+            raise KeyError(key)
+        setattr(self, key, value)
+
+    def __delitem__(self, key):
+        raise TypeError("member fields can't be deleted")
+
+    def to_dict(self):
+        # plain dict copy (alts included), much faster than dict(member)
+        # which goes through __getitem__ for every key
+        return {
+            "messages": self.messages,
+            "name": self.name,
+            "alt": list(self.alt) if self.alt is not None else None,
+            "is_alt": bool(self.flags & IS_ALT),
+            "is_bot": bool(self.flags & IS_BOT),
+        }
+
+    def __iter__(self):
+        return iter(KEYS)
+
+    def __len__(self):
+        return len(KEYS)
+
+    def __repr__(self):
+        return f"Member({dict(self)!r})"
+
+
+def member_hook(obj):
+    # json object_hook that turns saved users into members
+    if "is_bot" in obj and "messages" in obj:
+        return Member.from_dict(obj)
+    return obj
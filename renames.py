@@ -0,0 +1,94 @@
+import asyncio
+
+from metrics import metrics
+from utils import mark_changed
+
+# seconds between two batches of names being applied
+INTERVAL = 5
+
+
+class Renames:
+    # names that changed (seen in user/member updates, messages or the sweep
+    # of the member cache) are queued and applied in batches, so a guild gets
+    # saved once for every user renamed in between
+
+    def __init__(self, bot, interval=INTERVAL):
+        self.bot = bot
+        self.interval = interval
+        self.pending = {}  # server (None for every guild) -> {id: name}
+        self._task = None
+        self._cursor = None
+
+    def queue(self, server, id, name):
+        try:
+            self.pending[server][id] = name
+        except KeyError:
+            self.pending[server] = {id: name}
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._later())
+
+    async def _later(self):
+        await asyncio.sleep(self.interval)
+        self.apply()
+
+    def apply(self):
+        # renames the queued users in the loaded guilds, unloaded ones are
+        # left as they are rather than read just for this
+        pending, self.pending = self.pending, {}
+        everywhere = pending.pop(None, {})
+        msg_dic = self.bot.msg_dic
+
+        if everywhere:
+            for server in list(msg_dic):
+                guild = msg_dic[server]
+                for id, name in everywhere.items():
+                    if id in guild:
+                        pending.setdefault(server, {}).setdefault(id, name)
+
+        renamed = 0
+        for server, names in pending.items():
+            if server not in msg_dic:
+                continue
+
+            guild = msg_dic[server]
+            index = self.bot.names.get(server)
+            changed = []
+            for id, name in names.items():
+                if id in guild and guild[id]["name"] != name:
+                    guild[id]["name"] = name
+                    if index is not None:
+                        index.add(id)
+                    changed.append(id)
+
+            if changed:
+                mark_changed(self.bot, server, *changed)
+                renamed += len(changed)
+
+        if renamed:
+            metrics.inc("renames_total", renamed)
+
+    def sweep(self, guilds, amount):
+        # compares the next `amount` members of discord.py's cache with the
+        # stored names, starting over once every guild was seen
+        msg_dic = self.bot.msg_dic
+        for _ in range(amount):
+            try:
+                server, member = next(self._cursor)
+            except (TypeError, StopIteration):
+                self._cursor = self._members(guilds)
+                try:
+                    server, member = next(self._cursor)
+                except StopIteration:
+                    return
+
+            id = str(member.id)
+            if server in msg_dic and id in msg_dic[server]:
+                if msg_dic[server][id]["name"] != member.name:
+                    self.queue(server, id, member.name)
+
+    def _members(self, guilds):
+        for guild in list(guilds):
+            server = str(guild.id)
+            for member in list(guild.members):
+                yield server, member
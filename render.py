@@ -0,0 +1,144 @@
+def lb_entry(msg_dic, id, messages):
+    # formats a user's line on the leaderboard
+    alts = msg_dic[id]["alt"]
+
+    if not alts:
+        return f"{messages}: {msg_dic[id]['name']}"
+
+    elif len(alts) == 1:
+        return f"{messages}: {msg_dic[id]['name']} + alt"
+
+    else:
+        return f"{messages}: {msg_dic[id]['name']} +{len(alts)} alts"
+
+
+# users listed on each page of the leaderboard
+PAGE = 20
+
+
+class Board:
+    # a rendered leaderboard, kept until the guild's data or minimum changes.
+    # pages are only rendered when someone asks for them, and the requester's
+    # line is highlighted by slicing the cached text of the page
+
+    def __init__(self, key, msg_dic, ranking, minimum):
+        self.key = key
+        self.msg_dic = msg_dic
+        self.ranking = ranking
+        self.minimum = minimum
+        # only the users with more than a certain minimum are listed, the bots
+        # that reach it are listed after them (so they're never on the top)
+        self.count = ranking.users.count_at_least(minimum)
+        self.bots = ranking.bots.count_at_least(minimum)
+        self.pages = max(-(-(self.count + self.bots) // PAGE), 1)
+        self._pages = {}  # page -> (text, {id: (start, end) of its line})
+
+    def _render(self, page):
+        lines = []
+        offsets = {}
+        position = 0
+        start, stop = page * PAGE, (page + 1) * PAGE
+
+        for user, messages in self.ranking.users.items(start, min(stop, self.count)):
+            line = f"{lb_entry(self.msg_dic, user, messages)}\n"
+            offsets[user] = (position, position + len(line))
+            position += len(line)
+            lines.append(line)
+
+        # every page holds at most PAGE lines, bots included, so none of them
+        # gets past the size limit of an embed
+        if stop > self.count and self.bots:
+            first = max(start - self.count, 0)
+            if not first:
+                lines.append("\n")
+            lines.extend(
+                f"{messages}: {self.msg_dic[user]['name']}\n"
+                for user, messages in self.ranking.bots.items(
+                    first, min(stop - self.count, self.bots)
+                )
+            )
+
+        text = "".join(lines)
+        self._pages[page] = text, offsets
+        return text, offsets
+
+    def show(self, author, page=0):
+        # a page of the leaderboard as seen by `author`
+        try:
+            text, offsets = self._pages[page]
+        except KeyError:
+            text, offsets = self._render(page)
+
+        if author in offsets:
+            start, end = offsets[author]
+            return f"{text[:start]}**{text[start:end]}**{text[end:]}"
+
+        # adds message author to the end if not already on the page
+        if author in self.ranking.users or (
+            author in self.ranking.bots and self.ranking.get(author) < self.minimum
+        ):
+            entry = lb_entry(self.msg_dic, author, self.ranking.get(author))
+            return f"{text}**{entry}**"
+
+        return text
+
+
+def top_page(msg_dic, users, bots, author, messages=None):
+    # first page of a leaderboard made from the (id, total) rows of the
+    # storage's index, laid out like the pages of Board. `messages` is the
+    # author's total, if they have to be added at the end
+    lines = [f"{lb_entry(msg_dic, user, total)}\n" for user, total in users]
+    for i, (user, _) in enumerate(users):
+        if user == author:
+            lines[i] = f"**{lines[i]}**"
+            messages = None
+
+    if bots:
+        lines.append("\n")
+        lines.extend(f"{total}: {msg_dic[user]['name']}\n" for user, total in bots)
+
+    text = "".join(lines)
+    if messages is not None:
+        text += f"**{lb_entry(msg_dic, author, messages)}**"
+    return text
+
+
+class GlobalBoard:
+    # a rendered leaderboard of every guild, kept until a total changes
+    # somewhere. pages are rendered like the ones of Board
+
+    def __init__(self, key, ranking):
+        self.key = key
+        self.ranking = ranking
+        self.pages = max(-(-len(ranking.users) // PAGE), 1)
+        self._pages = {}  # page -> (text, {id: (start, end) of its line})
+
+    def _render(self, page):
+        lines = []
+        offsets = {}
+        position = 0
+
+        for user, messages in self.ranking.users.items(page * PAGE, (page + 1) * PAGE):
+            line = f"{messages}: {self.ranking.names[user]}\n"
+            offsets[user] = (position, position + len(line))
+            position += len(line)
+            lines.append(line)
+
+        self._pages[page] = "".join(lines), offsets
+        return self._pages[page]
+
+    def show(self, author, page=0):
+        try:
+            text, offsets = self._pages[page]
+        except KeyError:
+            text, offsets = self._render(page)
+
+        if author in offsets:
+            start, end = offsets[author]
+            return f"{text[:start]}**{text[start:end]}**{text[end:]}"
+
+        if author in self.ranking.users:
+            messages = self.ranking.users.get(author)
+            return f"{text}**{messages}: {self.ranking.names[author]}**"
+
+        return text
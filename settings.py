@@ -0,0 +1,177 @@
+import asyncio
+import json
+import os
+
+from metrics import PORT
+
+SECRETS = "secrets.json"
+
+# seconds to wait for more changes before saving the settings
+DELAY = 1
+
+# name -> (type, default) of every setting of a guild
+GUILD = {
+    "minimum": (int, 20000),
+    "listen_to_all": (bool, True),
+    # whether the guild's users are listed on -globallb
+    "global_lb": (bool, True),
+    # whether -backfill already counted the messages sent before the bot joined
+    "backfilled": (bool, False),
+}
+
+# name -> (type, default) of the settings of the whole bot
+GLOBAL = {
+    "metrics_port": (int, PORT),
+    "max_guilds": (int, 0),
+    "max_members": (int, 0),
+    # milliseconds the event loop can be blocked before its stack is logged
+    "stall_ms": (int, 0),
+    # names of cached members compared with the stored ones every minute
+    "name_sweep": (int, 0),
+}
+
+
+def check(schema, name, value):
+    # the value converted to the type of the setting, or its default if it
+    # can't be
+    kind, default = schema[name]
+    if value is None:
+        # null is how an optional setting is turned off
+        return None if name in GLOBAL else default
+
+    if kind is int and not isinstance(value, bool):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            pass
+
+    elif kind is bool and isinstance(value, bool):
+        return value
+
+    print(f"Invalid value for {name}: {value!r}, using {default!r}")
+    return default
+
+
+class GuildSettings:
+    # settings of a single guild, every one of them is a plain attribute so
+    # on_message can read them without any lookup of its own
+
+    __slots__ = tuple(GUILD)
+
+    def __init__(self, **values):
+        for name, (_, default) in GUILD.items():
+            setattr(self, name, check(GUILD, name, values.get(name, default)))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in GUILD}
+
+
+def load_secrets(filename=SECRETS):
+    try:
+        with open(filename, "r") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def save_secrets(secrets, filename=SECRETS):
+    # only readable by the user running the bot
+    temp = f"{filename}.tmp"
+    descriptor = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(descriptor, "w") as f:
+        json.dump(secrets, f, indent=4)
+
+    os.replace(temp, filename)
+
+
+def split_secrets(saved, filename=SECRETS):
+    # moves a token saved with the settings (as older versions did) to the
+    # secrets file, returns True if there was one
+    if "token" not in saved:
+        return False
+
+    secrets = load_secrets(filename)
+    secrets.setdefault("token", saved.pop("token"))
+    save_secrets(secrets, filename)
+    return True
+
+
+class Settings:
+    # every setting of the bot: the global ones, a GuildSettings per guild
+    # (created with the defaults the first time a guild is seen), and the
+    # secrets, which are never written to the settings file. changes are
+    # saved together a second after the last one
+
+    def __init__(self, storage, secrets=SECRETS, delay=DELAY):
+        self.storage = storage
+        self.secrets_file = secrets
+        self.delay = delay
+        self.values = {}
+        self.guilds = {}
+        self._task = None
+
+        saved = storage.load_settings()
+        moved = split_secrets(saved, secrets)
+        self.secrets = load_secrets(secrets)
+
+        for key, value in saved.items():
+            if isinstance(value, dict):
+                self.guilds[key] = GuildSettings(**value)
+            elif key in GLOBAL:
+                self.values[key] = check(GLOBAL, key, value)
+
+        if moved:
+            self.save_now()
+
+    @property
+    def token(self):
+        return self.secrets.get("token")
+
+    @token.setter
+    def token(self, value):
+        self.secrets["token"] = value
+        save_secrets(self.secrets, self.secrets_file)
+
+    def get(self, name):
+        # a global setting
+        return self.values.get(name, GLOBAL[name][1])
+
+    def guild(self, server):
+        try:
+            return self.guilds[server]
+        except KeyError:
+            settings = self.guilds[server] = GuildSettings()
+            self.save()
+            return settings
+
+    def to_dict(self):
+        return {
+            **self.values,
+            **{server: guild.to_dict() for server, guild in self.guilds.items()},
+        }
+
+    def save(self):
+        # saves on the next second, together with whatever else changes
+        try:
+            loop = asyncio.get_event_loop()
+        except RuntimeError:
+            return self.save_now()
+
+        if not loop.is_running():
+            return self.save_now()
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._later())
+
+    async def _later(self):
+        await asyncio.sleep(self.delay)
+        self.save_now()
+
+    def save_now(self):
+        self.storage.save_settings(self.to_dict())
+
+    def flush(self):
+        # saves right away if a save is waiting
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            self.save_now()
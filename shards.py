@@ -0,0 +1,83 @@
+# sharded deployment: `python shards.py --shards 8 --processes 4` starts 4
+# copies of main.py that connect with 2 of the 8 shards each. discord only
+# sends a shard the events of its own guilds, so every command is answered by
+# the process that owns the guild, and every process saves its guilds to the
+# shared messages.db (python storage.py has to be run once before)
+
+import argparse
+import os
+import subprocess
+import sys
+
+from settings import load_secrets
+from storage import DATABASE, SQLiteStorage
+
+SHARDS = "MSGLB_SHARDS"
+SHARD_COUNT = "MSGLB_SHARD_COUNT"
+GROUP = "MSGLB_GROUP"
+
+
+def shard_of(server, count):
+    # shard discord sends a guild's events to
+    return (int(server) >> 22) % count
+
+
+def config(environ=os.environ):
+    # (shard ids, shard count, group number) this process was started with,
+    # (None, None, 0) if it wasn't started by the launcher
+    if SHARDS not in environ:
+        return None, None, 0
+
+    ids = [int(id) for id in environ[SHARDS].split(",")]
+    return ids, int(environ[SHARD_COUNT]), int(environ.get(GROUP, 0))
+
+
+def groups(count, processes):
+    # splits the shards between the processes, [[0, 2], [1, 3]] for 4 and 2
+    return [list(range(group, count, processes)) for group in range(processes)]
+
+
+class Ownership:
+    # tells if a guild belongs to the shards of this process
+
+    def __init__(self, ids, count):
+        self.ids = set(ids)
+        self.count = count
+
+    def __call__(self, server):
+        return shard_of(server, self.count) in self.ids
+
+
+def main():
+    parser = argparse.ArgumentParser(description="runs the bot in several processes")
+    parser.add_argument("--shards", type=int, required=True)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    processes = max(min(args.processes, args.shards), 1)
+
+    # the processes can't ask for a token, and need the shared database
+    if not os.path.exists(DATABASE):
+        sys.exit(f"{DATABASE} not found, run python storage.py first")
+    if "token" not in load_secrets() and "token" not in SQLiteStorage().load_settings():
+        sys.exit("no token saved, run python main.py once first")
+
+    children = []
+    for group, ids in enumerate(groups(args.shards, processes)):
+        environ = dict(os.environ)
+        environ[SHARDS] = ",".join(map(str, ids))
+        environ[SHARD_COUNT] = str(args.shards)
+        environ[GROUP] = str(group)
+        children.append(subprocess.Popen([sys.executable, "main.py"], env=environ))
+
+    try:
+        for child in children:
+            child.wait()
+    except KeyboardInterrupt:
+        for child in children:
+            child.terminate()
+        for child in children:
+            child.wait()
+
+
+if __name__ == "__main__":
+    main()
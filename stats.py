@@ -0,0 +1,65 @@
+try:
+    import numpy
+except ImportError:
+    # works without it, only slower on big guilds
+    numpy = None
+
+# share of the most active users the top share is computed for
+TOP = 0.1
+
+
+def quantile(counts, q):
+    # linear interpolation between the closest ranks of sorted counts
+    position = q * (len(counts) - 1)
+    low = int(position)
+    high = min(low + 1, len(counts) - 1)
+    return counts[low] + (counts[high] - counts[low]) * (position - low)
+
+
+class Stats:
+    # distribution of the messages of a guild's ranked users (alts counted
+    # with their owner, bots left out), computed on a sorted array of their
+    # totals and kept until the guild's data changes
+
+    def __init__(self, key, ranking):
+        self.key = key
+        self.members = len(ranking.users)
+        self.total = 0
+        self.mean = self.median = self.p90 = self.p99 = 0
+        self.top_share = self.gini = 0.0
+
+        if not self.members:
+            return
+
+        if numpy is not None:
+            counts = numpy.fromiter(
+                ranking.users.values(), dtype=numpy.int64, count=self.members
+            )
+            counts.sort()
+            total = int(counts.sum())
+        else:
+            counts = sorted(ranking.users.values())
+            total = sum(counts)
+
+        n = self.members
+        self.total = total
+        self.mean = total / n
+        self.median = float(quantile(counts, 0.5))
+        self.p90 = float(quantile(counts, 0.9))
+        self.p99 = float(quantile(counts, 0.99))
+
+        if not total:
+            return
+
+        # messages of the top 10% (at least one user)
+        top = max(int(n * TOP), 1)
+        if numpy is not None:
+            self.top_share = int(counts[n - top :].sum()) / total
+            # gini of sorted counts: sum((2i - n - 1) * x_i) / (n * total)
+            weights = numpy.arange(1 - n, n, 2, dtype=numpy.float64)
+            self.gini = float(weights @ counts) / (n * total)
+        else:
+            self.top_share = sum(counts[n - top :]) / total
+            self.gini = sum(
+                (2 * i - n + 1) * count for i, count in enumerate(counts)
+            ) / (n * total)
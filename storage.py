@@ -0,0 +1,398 @@
+import asyncio
+import json
+import os
+import sqlite3
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from journal import Journal, replay
+from metrics import metrics
+from persistence import Persistence
+from records import Member, member_hook
+from settings import split_secrets
+from utils import FILENAME, SETTINGS, update_settings
+
+DATABASE = "messages.db"
+
+# seconds to wait for more changes before committing them to the database
+DELAY = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS members (
+    guild INTEGER NOT NULL,
+    id INTEGER NOT NULL,
+    messages INTEGER NOT NULL,
+    total INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    alt TEXT,
+    is_alt INTEGER NOT NULL,
+    is_bot INTEGER NOT NULL,
+    PRIMARY KEY (guild, id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS members_rank ON members (guild, is_alt, is_bot, total);
+CREATE TABLE IF NOT EXISTS settings (guild TEXT PRIMARY KEY, data TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS config (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+"""
+
+UPSERT = """
+INSERT INTO members (guild, id, messages, total, name, alt, is_alt, is_bot)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT (guild, id) DO UPDATE SET
+    messages = excluded.messages,
+    total = excluded.total,
+    name = excluded.name,
+    alt = excluded.alt,
+    is_alt = excluded.is_alt,
+    is_bot = excluded.is_bot
+"""
+
+
+def connect(database):
+    db = sqlite3.connect(database, check_same_thread=False)
+    db.execute("PRAGMA journal_mode = WAL")
+    db.execute("PRAGMA synchronous = NORMAL")
+    # sharded processes share the database, a writer waits for the others
+    db.execute("PRAGMA busy_timeout = 10000")
+    db.executescript(SCHEMA)
+    return db
+
+
+def save_settings(db, settings, owns=None):
+    # global values go to config, guilds to settings. `owns` leaves out the
+    # guilds another process is responsible for
+    config = []
+    guilds = []
+    for key, value in settings.items():
+        if isinstance(value, dict):
+            if owns is None or owns(key):
+                guilds.append((key, json.dumps(value)))
+        else:
+            config.append((key, json.dumps(value)))
+
+    db.executemany("INSERT OR REPLACE INTO config VALUES (?, ?)", config)
+    db.executemany("INSERT OR REPLACE INTO settings VALUES (?, ?)", guilds)
+    # the token lives in secrets.json now
+    db.execute("DELETE FROM config WHERE key = 'token'")
+
+
+def migrate(database=DATABASE, filename=FILENAME, settings=SETTINGS):
+    # one-shot copy of messages.json and settings.json into the database
+    storage = JSONStorage(filename, settings)
+    msg_dic = storage.load()
+    db = connect(database)
+
+    with db:
+        db.executemany(
+            UPSERT,
+            (
+                encode(msg_dic, server, id)
+                for server in msg_dic
+                for id in msg_dic[server]
+            ),
+        )
+        settings = storage.load_settings()
+        moved = split_secrets(settings)
+        save_settings(db, settings)
+
+    db.close()
+    if moved:
+        # settings.json isn't read anymore, but would keep the token in it
+        storage.save_settings(settings)
+    return sum(len(guild) for guild in msg_dic.values())
+
+
+class Guilds(OrderedDict):
+    # server -> guild, guilds that aren't in memory yet come from `loader`.
+    # guilds are kept in the order they were last used in, oldest first, so
+    # the coldest ones can be evicted
+
+    def __init__(self, loader, *args):
+        super().__init__(*args)
+        self.loader = loader
+
+    def __missing__(self, server):
+        metrics.inc("guild_cache_total", result="miss")
+        guild = self[server] = self.loader(server)
+        return guild
+
+    def touch(self, server):
+        # marks a guild as just used, loading it if it isn't in memory
+        try:
+            self.move_to_end(server)
+        except KeyError:
+            self[server]
+        else:
+            metrics.inc("guild_cache_total", result="hit")
+
+    def evict(self, server):
+        del self[server]
+        metrics.inc("guild_cache_total", result="eviction")
+
+
+def open_storage(owns=None):
+    # the database is used once messages.json was migrated to it
+    if os.path.exists(DATABASE):
+        return SQLiteStorage(owns=owns)
+
+    return JSONStorage()
+
+
+class JSONStorage:
+    # everything in messages.json and settings.json, with the journal
+    # covering the changes between two snapshots
+
+    # guilds can't be read again from messages.json, so they all stay loaded
+    can_evict = False
+
+    def __init__(self, filename=FILENAME, settings=SETTINGS):
+        self.filename = filename
+        self.settings = settings
+        self.persistence = None
+
+    def load_settings(self):
+        try:
+            with open(self.settings, "r") as f:
+                return json.loads(f.read())
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            return {}
+
+    def save_settings(self, settings):
+        update_settings(settings)
+
+    def load(self):
+        try:
+            with open(self.filename, "r") as f:
+                msg_dic = Guilds(
+                    lambda server: {}, json.loads(f.read(), object_hook=member_hook)
+                )
+        except (FileNotFoundError, json.decoder.JSONDecodeError):
+            msg_dic = Guilds(lambda server: {})
+
+        # applies whatever changed after the last save of messages.json
+        replay(msg_dic, self.filename)
+        self.persistence = Persistence(
+            msg_dic, self.filename, journal=Journal(msg_dic, self.filename)
+        )
+        return msg_dic
+
+    async def totals(self, foreign=False):
+        # every guild is loaded, so there is nothing more to read
+        return []
+
+    def mark(self, server, *ids, debounce=True):
+        self.persistence.mark(server, *ids, debounce=debounce)
+
+    async def flush(self):
+        await self.persistence.flush()
+
+
+def encode(msg_dic, server, id):
+    # row of a user, its total includes the messages of its alts
+    user = msg_dic[server][id]
+    total = user["messages"]
+    for alt in user["alt"] or ():
+        if alt in msg_dic[server]:
+            total += msg_dic[server][alt]["messages"]
+
+    return (
+        int(server),
+        int(id),
+        user["messages"],
+        total,
+        user["name"],
+        json.dumps(user["alt"]) if user["alt"] is not None else None,
+        user["is_alt"],
+        user["is_bot"],
+    )
+
+
+class SQLiteStorage:
+    # every guild in an indexed sqlite table, guilds are only read when they
+    # are first used and changes are committed in batches by a writer thread
+
+    can_evict = True
+
+    def __init__(self, database=DATABASE, delay=DELAY, owns=None):
+        self.database = database
+        self.delay = delay
+        self.owns = owns  # guilds of this process, when running sharded
+        self.msg_dic = None
+        self.pending = {}  # (server, id) -> None, used as an ordered set
+        self.db = connect(database)
+        self._writer = None
+        self._executor = ThreadPoolExecutor(1)
+        self._task = None
+        self._lock = asyncio.Lock()
+
+    def load_settings(self):
+        settings = {}
+        for key, value in self.db.execute("SELECT key, value FROM config"):
+            try:
+                settings[key] = json.loads(value)
+            except ValueError:
+                # a token saved by an older version
+                settings[key] = value
+        for guild, data in self.db.execute("SELECT guild, data FROM settings"):
+            settings[guild] = json.loads(data)
+
+        return settings
+
+    def save_settings(self, settings):
+        with metrics.timer("settings_save_seconds"), self.db:
+            save_settings(self.db, settings, self.owns)
+
+    def load(self):
+        self.msg_dic = Guilds(self.load_guild)
+        return self.msg_dic
+
+    def load_guild(self, server):
+        guild = {}
+        for id, messages, name, alt, is_alt, is_bot in self.db.execute(
+            "SELECT id, messages, name, alt, is_alt, is_bot FROM members "
+            "WHERE guild = ?",
+            (int(server),),
+        ):
+            guild[str(id)] = Member(
+                messages,
+                name,
+                json.loads(alt) if alt is not None else None,
+                is_alt,
+                is_bot,
+            )
+
+        return guild
+
+    def top(self, server, minimum, amount, bots=False):
+        # (id, total) of the users with the most messages (at least `minimum`),
+        # straight from the index
+        return [
+            (str(id), total)
+            for id, total in self.db.execute(
+                "SELECT id, total FROM members WHERE guild = ? AND is_alt = 0 "
+                "AND is_bot = ? AND total >= ? ORDER BY total DESC, id LIMIT ?",
+                (int(server), bots, minimum, amount),
+            )
+        ]
+
+    def count(self, server, minimum, bots=False):
+        # number of users with at least `minimum` messages
+        (count,) = self.db.execute(
+            "SELECT COUNT(*) FROM members WHERE guild = ? AND is_alt = 0 "
+            "AND is_bot = ? AND total >= ?",
+            (int(server), bots, minimum),
+        ).fetchone()
+        return count
+
+    def rank(self, server, id):
+        # (position, total, (position, total) of the closest user ahead or
+        # None) of a ranked user, counted on the index instead of sorting.
+        # None if the user isn't ranked
+        row = self.db.execute(
+            "SELECT total, is_alt, is_bot FROM members WHERE guild = ? AND id = ?",
+            (int(server), int(id)),
+        ).fetchone()
+        if row is None or row[1]:
+            return None
+
+        total, _, is_bot = row
+        position = self._position(server, is_bot, total)
+        closest = self.db.execute(
+            "SELECT MIN(total) FROM members WHERE guild = ? AND is_alt = 0 "
+            "AND is_bot = ? AND total > ?",
+            (int(server), is_bot, total),
+        ).fetchone()[0]
+        if closest is None:
+            return position, total, None
+
+        return position, total, (self._position(server, is_bot, closest), closest)
+
+    def _position(self, server, is_bot, total):
+        # users with the same total share a position
+        (ahead,) = self.db.execute(
+            "SELECT COUNT(*) FROM members WHERE guild = ? AND is_alt = 0 "
+            "AND is_bot = ? AND total > ?",
+            (int(server), is_bot, total),
+        ).fetchone()
+        return ahead + 1
+
+    async def totals(self, foreign=False):
+        # (server, id, total, name) of the ranked users of every guild taking
+        # part in the global leaderboard (only the guilds of the other
+        # processes if `foreign`), read by the writer thread so a big table
+        # doesn't hold up the bot
+        return await asyncio.get_event_loop().run_in_executor(
+            self._executor, self._totals, foreign
+        )
+
+    def _totals(self, foreign):
+        if self._writer is None:
+            self._writer = connect(self.database)
+
+        opted_out = {
+            int(guild)
+            for guild, data in self._writer.execute("SELECT guild, data FROM settings")
+            if json.loads(data).get("global_lb") is False
+        }
+        return [
+            (str(guild), str(id), total, name)
+            for guild, id, total, name in self._writer.execute(
+                "SELECT guild, id, total, name FROM members "
+                "WHERE is_alt = 0 AND is_bot = 0"
+            )
+            if guild not in opted_out
+            and not (foreign and self.owns is not None and self.owns(guild))
+        ]
+
+    def mark(self, server, *ids, debounce=True):
+        # the database is cheap to update, so counters get committed together
+        # with every other change
+        for id in ids:
+            self.pending[(server, id)] = None
+
+        if self._task is None or self._task.done():
+            self._task = asyncio.ensure_future(self._later())
+
+    async def _later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    def dirty(self, server):
+        # tells if a guild has changes that weren't committed yet
+        return any(guild == server for guild, _ in self.pending)
+
+    async def flush(self):
+        async with self._lock:
+            if not self.pending:
+                return
+
+            pending, self.pending = self.pending, {}
+            upserts = []
+            deletes = []
+            for server, id in pending:
+                if id in self.msg_dic[server]:
+                    upserts.append(encode(self.msg_dic, server, id))
+                else:
+                    deletes.append((int(server), int(id)))
+
+            with metrics.timer("flush_seconds", storage="sqlite"):
+                await asyncio.get_event_loop().run_in_executor(
+                    self._executor, self._write, upserts, deletes
+                )
+            metrics.inc("rows_written_total", len(upserts) + len(deletes))
+
+    def _write(self, upserts, deletes):
+        if self._writer is None:
+            self._writer = connect(self.database)
+
+        with self._writer:
+            self._writer.executemany(UPSERT, upserts)
+            self._writer.executemany(
+                "DELETE FROM members WHERE guild = ? AND id = ?", deletes
+            )
+
+
+if __name__ == "__main__":
+    if os.path.exists(DATABASE):
+        print(f"{DATABASE} already exists")
+    else:
+        print(f"{migrate()} users copied to {DATABASE}")
@@ -0,0 +1,201 @@
+import asyncio
+import csv
+import io
+import json
+
+from records import Member
+
+# columns of the csv files, alts are separated by spaces
+FIELDS = ("id", "messages", "name", "alts", "is_bot")
+
+# errors listed when a file is rejected
+MAX_ERRORS = 10
+
+# users written between two pauses of an export
+CHUNK = 1000
+
+
+def parse(data, filename):
+    # {id: member} of an attached file and the errors found in it
+    try:
+        text = data.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        return {}, ["the file isn't valid utf-8"]
+
+    if filename.lower().endswith(".json"):
+        return parse_json(text)
+    if filename.lower().endswith(".csv"):
+        return parse_csv(text)
+
+    return {}, ["only .csv and .json files can be imported"]
+
+
+def parse_json(text):
+    # the format of messages.json ({id: user}) or a list of users with an "id"
+    try:
+        data = json.loads(text)
+    except ValueError as error:
+        return {}, [f"invalid json: {error}"]
+
+    if isinstance(data, dict):
+        rows = [(id, user) for id, user in data.items()]
+    elif isinstance(data, list):
+        rows = [
+            (user.get("id") if isinstance(user, dict) else None, user) for user in data
+        ]
+    else:
+        return {}, ["the json must be an object or a list of users"]
+
+    users = {}
+    errors = []
+    for number, (id, user) in enumerate(rows, 1):
+        if not isinstance(user, dict):
+            errors.append(f"user {number}: not an object")
+            continue
+
+        add_user(
+            users,
+            errors,
+            f"user {number}",
+            id,
+            user.get("messages"),
+            user.get("name"),
+            user.get("alt", user.get("alts")),
+            user.get("is_bot", False),
+        )
+
+    return users, errors
+
+
+def parse_csv(text):
+    reader = csv.DictReader(io.StringIO(text))
+    missing = [
+        field
+        for field in ("id", "messages", "name")
+        if field not in (reader.fieldnames or ())
+    ]
+    if missing:
+        return {}, [f"missing columns: {', '.join(missing)}"]
+
+    users = {}
+    errors = []
+    for row in reader:
+        add_user(
+            users,
+            errors,
+            f"line {reader.line_num}",
+            row["id"],
+            row["messages"],
+            row["name"],
+            (row.get("alts") or "").split() or None,
+            (row.get("is_bot") or "").strip().lower() in ("1", "true", "yes"),
+        )
+
+    return users, errors
+
+
+def add_user(users, errors, where, id, messages, name, alts, is_bot):
+    # checks the fields of a user before adding it
+    id = str(id).strip() if id is not None else ""
+    if not id.isdecimal():
+        return errors.append(f"{where}: invalid id {id!r}")
+    if id in users:
+        return errors.append(f"{where}: {id} is listed twice")
+
+    try:
+        messages = int(messages)
+        if messages < 0:
+            raise ValueError
+    except (TypeError, ValueError):
+        return errors.append(f"{where}: invalid number of messages {messages!r}")
+
+    if not isinstance(name, str) or not name.strip():
+        return errors.append(f"{where}: missing name")
+
+    if alts is not None:
+        if not isinstance(alts, list) or not all(str(alt).isdecimal() for alt in alts):
+            return errors.append(f"{where}: invalid alts {alts!r}")
+        alts = [str(alt) for alt in alts] or None
+
+    if not isinstance(is_bot, bool):
+        return errors.append(f"{where}: is_bot must be true or false")
+
+    users[id] = Member(messages, name.strip(), alts, is_bot=is_bot)
+
+
+def merge(msg_dic, users):
+    # the guild with the imported users replacing the ones it had, and the
+    # errors in the alt groups that would result (nothing is changed here)
+    guild = dict(msg_dic)
+    guild.update(users)
+    owners = {}
+    errors = []
+
+    for id, user in guild.items():
+        for alt in user["alt"] or ():
+            if alt == id:
+                errors.append(f"{id} can't be an alt of itself")
+            elif alt not in guild:
+                errors.append(f"alt {alt} of {id} isn't on the leaderboard")
+            elif guild[alt]["alt"]:
+                errors.append(f"alt {alt} of {id} has alts of its own")
+            elif owners.setdefault(alt, id) != id:
+                errors.append(f"{alt} is an alt of both {owners[alt]} and {id}")
+
+    if errors:
+        return None, errors
+
+    # alts are whoever some user lists as one, users whose flag changes are
+    # copied so the current guild stays untouched
+    for id, user in guild.items():
+        if user["is_alt"] != (id in owners):
+            if id not in users:
+                user = guild[id] = Member.from_dict(user)
+            user["is_alt"] = id in owners
+
+    return guild, []
+
+
+async def export(msg_dic, f, format="csv"):
+    # writes a guild to a binary file a chunk of users at a time, letting
+    # other events run in between
+    text = io.TextIOWrapper(f, encoding="utf-8", newline="")
+    ids = list(msg_dic)
+    separator = ""
+
+    if format == "csv":
+        writer = csv.writer(text)
+        writer.writerow(FIELDS)
+    else:
+        text.write("{")
+
+    for start in range(0, len(ids), CHUNK):
+        for id in ids[start : start + CHUNK]:
+            user = msg_dic.get(id)
+            if user is None:
+                continue
+
+            if format == "csv":
+                writer.writerow(
+                    (
+                        id,
+                        user["messages"],
+                        user["name"],
+                        " ".join(user["alt"] or ()),
+                        "true" if user["is_bot"] else "false",
+                    )
+                )
+            else:
+                text.write(
+                    f"{separator}\n{json.dumps(id)}: {json.dumps(user.to_dict())}"
+                )
+                separator = ","
+
+        await asyncio.sleep(0)
+
+    if format != "csv":
+        text.write("\n}\n")
+
+    text.flush()
+    text.detach()
+    f.seek(0)
@@ -1,86 +1,480 @@
-import json
-import uuid
-import os
-
-FILENAME = "messages.json"
-SETTINGS = "settings.json"
-
-
-def saver():
-    try:
-        with open("messages.json", "r") as a:
-            dic = json.loads(a.read())
-            for key in dic:
-                simple_dic = dic[key]
-                with open(f"{key}.json", "w") as b:
-                    json.dump(simple_dic, b, indent=4)
-        print("Backup done!")
-    except FileNotFoundError:
-        print("file not found, will try again in 24 hours")
-
-
-def update_settings(bot_settings):
-    temp = f"{uuid.uuid4()}-{SETTINGS}.tmp"
-    with open(temp, "w") as f:
-        json.dump(bot_settings.copy(), f, indent=4)
-
-    os.replace(temp, SETTINGS)
-
-
-def update_json(bot_msg_dic):
-    temp = f"{uuid.uuid4()}-{FILENAME}.tmp"
-    with open(temp, "w") as f:
-        json.dump(bot_msg_dic.copy(), f, indent=4)
-
-    os.replace(temp, FILENAME)
-
-
-def alt_handler(bot, ctx, user, alt, add=True):
-    msg_dic = bot.msg_dic[str(ctx.message.guild.id)]
-
-    if user == alt:
-        return f"{user} can't be an alt of itself"
-
-    elif str(user.id) not in msg_dic:
-        if add:
-            return f"Error: {user} not found, try doing `-edit {user.id} <message_number>` first"
-        else:
-            return f"Error: {user} not found"
-
-    elif str(alt.id) not in msg_dic:
-        if add:
-            return f"Error: {alt} not found, try doing `-edit {alt.id} <message_number>` first"
-        else:
-            return f"Error: {alt} not found"
-
-    elif add and msg_dic[str(alt.id)]["is_alt"]:
-        return f"Error: {alt.name} ({alt.id}) is already an alt"
-
-    elif not add and not msg_dic[str(user.id)]["alt"]:
-        return f"Error: {user} has no alts"
-
-    elif add and msg_dic[str(user.id)]["is_alt"]:
-        return f"Error: {user.name} ({user.id}) is already an alt"
-
-    elif not add and not msg_dic[str(alt.id)]["is_alt"]:
-        return f"Error: {alt} is not an alt"
-
-    else:
-        if add:
-            if msg_dic[str(user.id)]["alt"] is None:
-                msg_dic[str(user.id)]["alt"] = [str(alt.id)]
-            else:
-                msg_dic[str(user.id)]["alt"].append(str(alt.id))
-
-            msg_dic[str(alt.id)]["is_alt"] = True
-            update_settings(bot.msg_dic)
-            return f"{alt} was saved as an alt of {user}"
-        else:
-            if len(msg_dic[str(user.id)]["alt"]) == 1:
-                msg_dic[str(user.id)]["alt"] = None
-            else:
-                msg_dic[str(user.id)]["alt"].remove(str(alt.id))
-
-            msg_dic[str(alt.id)]["is_alt"] = False
-            update_settings(bot.msg_dic)
-            return f"{alt} is no longer an alt of {user}"
+import asyncio
+import json
+import uuid
+import os
+
+from activity import WindowTotals
+from alts import AltIndex
+from metrics import metrics
+from names import NameIndex
+from ranking import GlobalRanking, Leaderboard
+from render import Board, GlobalBoard
+from stats import Stats
+
+FILENAME = "messages.json"
+SETTINGS = "settings.json"
+
+
+def update_settings(bot_settings):
+    with metrics.timer("settings_save_seconds"):
+        temp = f"{uuid.uuid4()}-{SETTINGS}.tmp"
+        with open(temp, "w") as f:
+            json.dump(bot_settings.copy(), f, indent=4)
+
+        os.replace(temp, SETTINGS)
+
+
+def guild_settings(bot, server):
+    # returns the guild's settings, saving the defaults the first time
+    return bot.settings.guild(server)
+
+
+def get_alts(bot, server):
+    # returns the guild's alt groups, building them the first time they're needed
+    try:
+        return bot.alts[server]
+    except KeyError:
+        alts = bot.alts[server] = AltIndex(bot.msg_dic[server])
+        return alts
+
+
+def get_ranking(bot, server):
+    # returns the guild's ranking, building it the first time it's needed
+    try:
+        return bot.ranks[server]
+    except KeyError:
+        ranking = bot.ranks[server] = Leaderboard(
+            bot.msg_dic[server], get_alts(bot, server)
+        )
+        return ranking
+
+
+def rank_of(ranking, id):
+    # (position, messages, (position, messages) of the closest user ahead or
+    # None) of a ranked user, None if they aren't ranked
+    if id not in ranking:
+        return None
+
+    index = ranking.index(id)
+    ahead = index.ahead(id)
+    if ahead is not None:
+        ahead = (index.rank(ahead[0]), ahead[1])
+
+    return index.rank(id), index.get(id), ahead
+
+
+def get_names(bot, server):
+    # returns the guild's name index, building it the first time it's needed
+    try:
+        return bot.names[server]
+    except KeyError:
+        names = bot.names[server] = NameIndex(bot.msg_dic[server])
+        return names
+
+
+def mark_changed(bot, server, *ids, debounce=True, shown=True):
+    # saves the users that changed, flags their guild for the next backup and
+    # invalidates its rendered leaderboard (unless `shown` says the change
+    # can't be seen on it)
+    bot.storage.mark(server, *ids, debounce=debounce)
+    bot.backups.mark(server)
+    if shown:
+        bot.versions[server] = bot.versions.get(server, 0) + 1
+    if bot.network is not None or bot.network_changes is not None:
+        update_network(bot, server, ids)
+
+
+def update_network(bot, server, ids):
+    # passes the new totals of some users of a guild to the global leaderboard,
+    # or keeps them for when it's done being built
+    if bot.network_changes is not None:
+        bot.network_changes.update((server, id) for id in ids)
+        return
+
+    if not guild_settings(bot, server).global_lb:
+        return
+
+    msg_dic = bot.msg_dic[server]
+    ranking = get_ranking(bot, server)
+    for id in ids:
+        name = msg_dic[id]["name"] if id in msg_dic else None
+        bot.network.set(server, id, ranking.users.get(id), name)
+
+
+def toggle_network(bot, server):
+    # adds or takes off a guild after its global_lb setting changed
+    if bot.network_changes is not None:
+        bot.network_changes.add((server, None))
+        return
+
+    if bot.network is None:
+        return
+
+    bot.network.drop(server)
+    if guild_settings(bot, server).global_lb and server in bot.msg_dic:
+        bot.network.add_guild(server, bot.msg_dic[server], get_ranking(bot, server))
+
+
+async def get_network(bot):
+    # returns the global leaderboard, built the first time it's needed. the
+    # commands asking for it while it's built all wait for the same build
+    if bot.network is None:
+        if bot.network_task is None:
+            bot.network_task = asyncio.ensure_future(build_network(bot))
+        await asyncio.shield(bot.network_task)
+
+    return bot.network
+
+
+async def build_network(bot):
+    # builds the global leaderboard in a worker thread from what the storage
+    # has and the rankings of the loaded guilds, replaying the changes made
+    # in the meantime once it's swapped in
+    bot.network_changes = set()
+    try:
+        bot.settings.flush()
+        if bot.storage.can_evict:
+            # the rows have to be up to date, without eviction there are none
+            await bot.storage.flush()
+        rows = await bot.storage.totals()
+
+        # the loaded guilds may have changed since they were saved. those
+        # with a ranking pass its totals, those without one are saved as they
+        # are, unless nothing gets evicted and the storage has no rows at all:
+        # their users are then copied (a plain dict copy, so nothing is
+        # allocated per user) and totaled in the worker thread
+        guilds = []
+        members = []
+        for server in list(bot.msg_dic):
+            if not guild_settings(bot, server).global_lb:
+                continue
+            if server in bot.ranks:
+                ranking = bot.ranks[server]
+                guilds.append((server, ranking.users.totals(), bot.msg_dic[server]))
+            elif not bot.storage.can_evict:
+                members.append((server, dict(bot.msg_dic[server])))
+
+        owns = bot.storage.owns if bot.storage.can_evict else None
+        network, foreign = await asyncio.get_event_loop().run_in_executor(
+            None, _build_network, rows, guilds, members, owns
+        )
+    except BaseException:
+        bot.network_changes = None
+        raise
+    finally:
+        bot.network_task = None
+
+    changes, bot.network_changes = bot.network_changes, None
+    bot.network = network
+    bot.network_foreign = foreign
+    for server, id in changes:
+        if id is None:
+            toggle_network(bot, server)
+    for server, id in changes:
+        if id is not None and server in bot.msg_dic:
+            update_network(bot, server, (id,))
+
+
+def _build_network(rows, guilds, members, owns):
+    # the rows of a loaded guild are replaced by its ranking if it has one, or
+    # by rows made from its users. when sharded, the rows of the other
+    # processes' guilds are kept so they can be refreshed by difference
+    skip = {server for server, _, _ in guilds}
+    skip.update(server for server, _ in members)
+    saved = [row for row in rows if row[0] not in skip]
+    for server, guild in members:
+        saved.extend(_guild_rows(server, guild))
+    network = GlobalRanking.from_rows(saved, guilds)
+    foreign = None
+    if owns is not None:
+        foreign = {
+            (server, id): (total, name)
+            for server, id, total, name in rows
+            if not owns(server)
+        }
+
+    return network, foreign
+
+
+def _guild_rows(server, guild):
+    # (server, id, total, name) of the ranked users of a copy of a guild. alts
+    # are counted with their owner, like the storage does
+    rows = []
+    for id, user in guild.items():
+        if user["is_alt"] or user["is_bot"]:
+            continue
+
+        total = user["messages"]
+        for alt in user["alt"] or ():
+            if alt in guild:
+                total += guild[alt]["messages"]
+        rows.append((server, id, total, user["name"]))
+
+    return rows
+
+
+async def refresh_network(bot):
+    # applies what the other processes saved since the global leaderboard was
+    # built, only to the users whose share changed
+    network = bot.network
+    if network is None or bot.network_foreign is None:
+        return
+
+    rows = await bot.storage.totals(foreign=True)
+    changes, foreign = await asyncio.get_event_loop().run_in_executor(
+        None, GlobalRanking.diff, bot.network_foreign, rows
+    )
+    if bot.network is not network:
+        # built again in the meantime
+        return
+
+    for server, id, total, name in changes:
+        network.set(server, id, total, name)
+    bot.network_foreign = foreign
+
+
+def get_network_board(bot, network):
+    # returns the rendered global leaderboard, rendering it again only if a
+    # total changed since the last time
+    board = bot.network_board
+    if board is None or board.ranking is not network or board.key != network.version:
+        board = bot.network_board = GlobalBoard(network.version, network)
+
+    return board
+
+
+def get_board(bot, server):
+    # returns the guild's rendered leaderboard, rendering it again only if
+    # something changed since the last time
+    minimum = guild_settings(bot, server).minimum
+    key = (bot.versions.get(server, 0), minimum)
+    board = bot.boards.get(server)
+
+    if board is None or board.key != key:
+        board = bot.boards[server] = Board(
+            key, bot.msg_dic[server], get_ranking(bot, server), minimum
+        )
+
+    return board
+
+
+def get_stats(bot, server):
+    # returns the distribution of the guild's messages, computed again only if
+    # something changed since the last time
+    ranking = get_ranking(bot, server)
+    # counters of users below the minimum don't change the version
+    key = (bot.versions.get(server, 0), ranking.users.version)
+    stats = bot.stats.get(server)
+
+    if stats is None or stats.key != key:
+        stats = bot.stats[server] = Stats(key, ranking)
+
+    return stats
+
+
+def get_window_board(bot, server, window):
+    # returns the leaderboard of the messages sent in the last day/week/month,
+    # only the users that talked in that window get ranked
+    rolling = bot.windows.rolling(server, window)
+    counts = bot.windows.get(server, window)
+    key = (bot.versions.get(server, 0), rolling.version)
+    board = bot.boards.get((server, window))
+
+    if board is None or board.key != key:
+        msg_dic = bot.msg_dic[server]
+        totals = WindowTotals(get_alts(bot, server), counts)
+        ranking = Leaderboard(msg_dic, totals, totals.totals)
+        board = bot.boards[(server, window)] = Board(key, msg_dic, ranking, 1)
+
+    return board
+
+
+def replace_guild(bot, server, guild, changed=None):
+    # swaps a guild's data, its indexes get rebuilt the next time they're used.
+    # `changed` are the users that need saving (all of them by default)
+    if changed is None:
+        ids = set(bot.msg_dic[server]) | set(guild)
+    else:
+        ids = changed
+    bot.msg_dic[server] = guild
+
+    for indexes in (bot.alts, bot.names, bot.ranks):
+        indexes.pop(server, None)
+
+    mark_changed(bot, server, *ids)
+
+
+async def evict_guilds(bot):
+    # drops the least recently used guilds from memory while there are more
+    # guilds (or users) loaded than the budget in the settings allows, they
+    # are read from the database again the next time they're used
+    msg_dic = bot.msg_dic
+    max_guilds = bot.settings.get("max_guilds")
+    max_members = bot.settings.get("max_members")
+    if not bot.storage.can_evict or not (max_guilds or max_members):
+        return 0
+
+    guilds = len(msg_dic)
+    members = sum(len(guild) for guild in msg_dic.values())
+    coldest = []
+    for server in msg_dic:
+        if (not max_guilds or guilds <= max_guilds) and (
+            not max_members or members <= max_members
+        ):
+            break
+
+        # a scan still needs its guild
+        if server not in bot.backfills:
+            coldest.append(server)
+            guilds -= 1
+            members -= len(msg_dic[server])
+
+    if not coldest:
+        return 0
+
+    for server in coldest:
+        bot.ingest.apply(server)
+    await bot.storage.flush()
+
+    evicted = 0
+    for server in coldest:
+        # skips the guilds that changed again during the flush
+        if (
+            server not in msg_dic
+            or server in bot.ingest.pending
+            or bot.storage.dirty(server)
+        ):
+            continue
+
+        msg_dic.evict(server)
+        for indexes in (bot.alts, bot.names, bot.ranks, bot.stats):
+            indexes.pop(server, None)
+        # its leaderboards go too, keyed by server and by (server, window) for
+        # the time windows
+        for key in [
+            key
+            for key in bot.boards
+            if key == server or isinstance(key, tuple) and key[0] == server
+        ]:
+            del bot.boards[key]
+        evicted += 1
+
+    return evicted
+
+
+def count_message(bot, server, id, amount=1):
+    # adds (or removes) messages from a user, keeping the indexes up to date
+    alts = get_alts(bot, server)
+    ranking = get_ranking(bot, server)
+    # the owner's total changes with its alts' messages
+    owner = alts.owner(id)
+    ranked = id if owner is None else owner
+    before = ranking.get(ranked)
+
+    bot.msg_dic[server][id]["messages"] += amount
+    alts.add(id, amount)
+    ranking.update(id)
+
+    # the leaderboard only lists the users above the minimum, so users that
+    # stay below it don't need it rendered again
+    minimum = guild_settings(bot, server).minimum
+    after = ranking.get(ranked)
+    shown = any(total is not None and total >= minimum for total in (before, after))
+    if owner is None:
+        mark_changed(bot, server, id, debounce=False, shown=shown)
+    else:
+        mark_changed(bot, server, id, owner, debounce=False, shown=shown)
+
+
+def refresh_user(bot, server, id):
+    # re-indexes a user after its data was replaced or it was deleted
+    names = get_names(bot, server)
+    if id in bot.msg_dic[server]:
+        names.add(id)
+    else:
+        names.discard(id)
+
+    alts = get_alts(bot, server)
+    owner = alts.owner(id)
+    alts.refresh(id)
+
+    ranking = get_ranking(bot, server)
+    ranking.update(id)
+    if owner is None:
+        mark_changed(bot, server, id)
+    else:
+        ranking.update(owner)
+        mark_changed(bot, server, id, owner)
+
+
+def not_found(bot, server, username):
+    # error message for an unknown username, with suggestions if there are any
+    names = get_names(bot, server)
+    matches = names.prefixed(username) or names.suggest(username)
+    result = f"Error: {username} not found"
+
+    if matches:
+        msg_dic = bot.msg_dic[server]
+        result += f", did you mean {', '.join(msg_dic[id]['name'] for id in matches)}?"
+
+    return result
+
+
+def alt_handler(bot, ctx, user, alt, add=True):
+    msg_dic = bot.msg_dic[str(ctx.message.guild.id)]
+
+    if user == alt:
+        return f"{user} can't be an alt of itself"
+
+    elif str(user.id) not in msg_dic:
+        if add:
+            return f"Error: {user} not found, try doing `-edit {user.id} <message_number>` first"
+        else:
+            return f"Error: {user} not found"
+
+    elif str(alt.id) not in msg_dic:
+        if add:
+            return f"Error: {alt} not found, try doing `-edit {alt.id} <message_number>` first"
+        else:
+            return f"Error: {alt} not found"
+
+    elif add and msg_dic[str(alt.id)]["is_alt"]:
+        return f"Error: {alt.name} ({alt.id}) is already an alt"
+
+    elif not add and not msg_dic[str(user.id)]["alt"]:
+        return f"Error: {user} has no alts"
+
+    elif add and msg_dic[str(user.id)]["is_alt"]:
+        return f"Error: {user.name} ({user.id}) is already an alt"
+
+    elif not add and not msg_dic[str(alt.id)]["is_alt"]:
+        return f"Error: {alt} is not an alt"
+
+    elif not add and str(alt.id) not in msg_dic[str(user.id)]["alt"]:
+        return f"Error: {alt} is not an alt of {user}"
+
+    else:
+        if add:
+            if msg_dic[str(user.id)]["alt"] is None:
+                msg_dic[str(user.id)]["alt"] = [str(alt.id)]
+            else:
+                msg_dic[str(user.id)]["alt"].append(str(alt.id))
+
+            msg_dic[str(alt.id)]["is_alt"] = True
+            get_alts(bot, str(ctx.message.guild.id)).link(str(user.id), str(alt.id))
+            get_ranking(bot, str(ctx.message.guild.id)).update(str(alt.id))
+            mark_changed(bot, str(ctx.message.guild.id), str(user.id), str(alt.id))
+            return f"{alt} was saved as an alt of {user}"
+        else:
+            if len(msg_dic[str(user.id)]["alt"]) == 1:
+                msg_dic[str(user.id)]["alt"] = None
+            else:
+                msg_dic[str(user.id)]["alt"].remove(str(alt.id))
+
+            msg_dic[str(alt.id)]["is_alt"] = False
+            get_alts(bot, str(ctx.message.guild.id)).unlink(str(user.id), str(alt.id))
+            ranking = get_ranking(bot, str(ctx.message.guild.id))
+            ranking.update(str(user.id))
+            ranking.update(str(alt.id))
+            mark_changed(bot, str(ctx.message.guild.id), str(user.id), str(alt.id))
+            return f"{alt} is no longer an alt of {user}"